@@ -1,101 +1,852 @@
 import os
+import asyncio
+import contextlib
+import contextvars
+import functools
+import itertools
+import queue
+import re
 import json
+import time
+import threading
 import pyodbc
 from dotenv import load_dotenv
-from fastmcp import FastMCP
-
-# Cargar variables de entorno
-load_dotenv()
-
-# Configuración de las bases de datos
-DB_CONFIGS = {
-    "default": {
-        "server": os.getenv("DEV_SERVER"),
-        "database": os.getenv("DEV_DATABASE"),
-        "username": os.getenv("DEV_USERNAME"),
-        "password": os.getenv("DEV_PASSWORD"),
-        "driver": "{ODBC Driver 17 for SQL Server}",
-    },
-    "INTEGRACION_CW_20_DEV": {
-        "server": os.getenv("DEV_SERVER"),
-        "database": "INTEGRACION_CW_20_DEV",
-        "username": os.getenv("DEV_USERNAME"),
-        "password": os.getenv("DEV_PASSWORD"),
-        "driver": "{ODBC Driver 17 for SQL Server}",
-    },
-}
+from fastmcp import Context, FastMCP
+from fastmcp.server.middleware import Middleware
+from fastmcp.utilities.logging import get_logger
+
+
+@functools.cache
+def _db_configs() -> dict:
+    """
+    Configuración de las bases de datos, construida en el primer uso
+
+    El archivo .env y las variables de entorno se leen una sola vez y no al importar el módulo.
+    """
+    # Cargar variables de entorno
+    load_dotenv()
+
+    return {
+        "default": {
+            "server": os.getenv("DEV_SERVER"),
+            "database": os.getenv("DEV_DATABASE"),
+            "username": os.getenv("DEV_USERNAME"),
+            "password": os.getenv("DEV_PASSWORD"),
+            "driver": "{ODBC Driver 17 for SQL Server}",
+            "schema": "dbo",
+        },
+        "INTEGRACION_CW_20_DEV": {
+            "server": os.getenv("DEV_SERVER"),
+            "database": "INTEGRACION_CW_20_DEV",
+            "username": os.getenv("DEV_USERNAME"),
+            "password": os.getenv("DEV_PASSWORD"),
+            "driver": "{ODBC Driver 17 for SQL Server}",
+            "schema": "dbo",
+        },
+    }
+
+
+@functools.cache
+def _conn_strings() -> dict:
+    """
+    Cadenas de conexión por clave de base de datos, calculadas una sola vez
+
+    La cadena es idéntica en cada llamada, requisito para que el pool ODBC reutilice la conexión.
+    """
+    return {
+        key: (
+            f"DRIVER={config['driver']};"
+            f"SERVER={config['server']};"
+            f"DATABASE={config['database']};"
+            f"UID={config['username']};"
+            f"PWD={config['password']}"
+        )
+        for key, config in _db_configs().items()
+    }
+
+
+@functools.cache
+def _db_keys() -> tuple:
+    """Claves de las bases de datos configuradas, en el orden de la configuración"""
+    return tuple(_db_configs())
+
+
+@functools.cache
+def _db_names() -> dict:
+    """Nombres de base de datos por clave"""
+    return {key: config["database"] for key, config in _db_configs().items()}
+
+
+@functools.cache
+def _db_schemas() -> dict:
+    """Esquema en el que se buscan las tablas de cada base de datos"""
+    return {key: config["schema"] for key, config in _db_configs().items()}
+
+
+@functools.cache
+def _server_groups() -> dict:
+    """Bases de datos accesibles desde una misma conexión (mismo servidor y credenciales)"""
+    return {
+        key: (config["server"], config["username"])
+        for key, config in _db_configs().items()
+    }
+
+
+# Habilitar el pool de conexiones del administrador ODBC (debe fijarse antes del primer connect)
+pyodbc.pooling = True
+
+# Pool de conexiones libres por clave de base de datos: pila (LIFO) de (conexión, último uso).
+# Se entrega primero la conexión usada más recientemente; las que sobran quedan al fondo,
+# superan _CONN_MAX_IDLE_S y se validan (o descartan) antes de volver a usarse.
+_CONN_POOLS: dict[str, queue.LifoQueue] = {}
+_CONN_POOL_SIZE = 4
+_CONN_LOCK = threading.Lock()
+
+# Segundos de inactividad a partir de los cuales se valida la conexión antes de reutilizarla
+_CONN_MAX_IDLE_S = 60
+_PING_TIMEOUT_S = 5
+
+# Caché de metadatos de INFORMATION_SCHEMA: (database_key, vista, nombre) -> (timestamp, filas)
+# - (db, "COLUMNS", tabla en minúsculas) -> columnas de la tabla en cualquier esquema
+# - (db, "COLUMNS.<esquema>", tabla en minúsculas) -> columnas de la tabla en ese esquema
+# - (db, "TABLES", esquema) -> nombres de las tablas del esquema
+# Las entradas se mantienen en orden de escritura (la más antigua primero) para podar por el frente.
+_SCHEMA_CACHE: dict[tuple[str, str, str], tuple[float, list]] = {}
+SCHEMA_CACHE_TTL_S = 300
+SCHEMA_CACHE_MAX_ENTRIES = 4096
+_SCHEMA_CACHE_LOCK = threading.Lock()
+
+# Caché de default_roles (excluyendo sys_admin): unidad normalizada -> (timestamp, roles).
+# Ninguna herramienta modifica default_roles; los cambios externos se ven al expirar el TTL
+# o tras invalidate_roles_cache. Como _SCHEMA_CACHE, se mantiene en orden de escritura.
+_ROLES_CACHE: dict[str, tuple[float, list]] = {}
+ROLES_CACHE_TTL_S = 300
+ROLES_CACHE_MAX_ENTRIES = 64
+_ROLES_CACHE_LOCK = threading.Lock()
+
+# Marcador @business_unit dentro de una query
+_BUSINESS_UNIT_RE = re.compile(r"@business_unit\b")
+
+# Literales de texto T-SQL, paréntesis sin otros paréntesis adentro y cláusulas del nivel
+# superior, para decidir si una query puede contarse como subconsulta
+_SQL_STRING_LITERAL_RE = re.compile(r"N?'(?:[^']|'')*'")
+_SQL_PARENTHESES_RE = re.compile(r"\([^()]*\)")
+_ORDER_BY_RE = re.compile(r"\bORDER\s+BY\b", re.IGNORECASE)
+# Con TOP u OFFSET el ORDER BY es válido en una subconsulta (y puede cambiar el total)
+_KEEPS_ORDER_BY_RE = re.compile(r"\b(?:TOP|OFFSET)\b", re.IGNORECASE)
+# Cláusulas que impiden usar la query como subconsulta
+_NOT_A_SUBQUERY_RE = re.compile(
+    r"^WITH\b|;|\bOPTION\b|\bFOR\s+(?:XML|JSON|BROWSE)\b", re.IGNORECASE
+)
+
+# Fragmentos de una query T-SQL recorridos en orden: literal de texto ('...' / N'...',
+# grupo 1), comentario (-- o /* */) o marcador @business_unit (grupo 2). Un apóstrofo dentro
+# de un comentario no abre un literal y un marcador dentro de un comentario no es un parámetro.
+_SQL_TOKEN_RE = re.compile(
+    r"(N?'(?:[^']|'')*')|--[^\n]*|/\*.*?\*/|(@business_unit\b)", re.DOTALL
+)
+
+# Referencia a la base de datos de integración dentro de una query (sin importar mayúsculas)
+_INTEGRACION_DB_RE = re.compile(r"INTEGRACION_CW_20_DEV", re.IGNORECASE)
+
+# Valores válidos de business_unit (el SP lo declara como NVARCHAR(20))
+_BUSINESS_UNIT_VALUE_RE = re.compile(r"[A-Za-z0-9_-]{1,20}")
+
+# Llamada al SP de creación de reportes, compartida por create_report y bulk_create_reports.
+# Al ejecutar siempre el mismo texto SQL en un cursor, pyodbc reutiliza la sentencia preparada.
+_SP_CREATE_COLUMNS_CONFIG = """
+EXEC sp_ecosystem_create_columns_config
+    ?, -- @report_prefix
+    ?, -- @report_description
+    ?, -- @report_description_es
+    'report', -- @type
+    1, -- @table_number
+    ?, -- @query
+    ?, -- @params_config
+    ?, -- @is_detail
+    ?, -- @hasDetail
+    ?, -- @actionColumn
+    ?, -- @detail_prefix
+    ?, -- @detail_mode
+    ?, -- @open_another_tab
+    ?, -- @type_resource
+    ?, -- @columns_to_render
+    ?  -- default_for_all
+"""
+
+# Reportes por llamada a executemany en bulk_create_reports
+_SP_BATCH_SIZE = 500
+
+# Validación de las asignaciones de bulk_assign_reports_to_roles
+_ASSIGNMENT_REQUIRED_FIELDS = (
+    "report_prefix",
+    "business_unit",
+    "role_description",
+    "application_type",
+)
+_VALID_APP_TYPES = frozenset({"sales_force", "merchandising"})
+# Campos que se normalizan y agrupan antes de consultar: deben llegar como texto
+_ASSIGNMENT_TEXT_FIELDS = ("report_prefix", "business_unit", "role_description")
+
+# Unidades de negocio por consulta en el IN de _load_roles: al rellenar un bloque con
+# _pad_in_list quedan a lo sumo 512 parámetros, lejos del máximo de 2100
+_MAX_UNITS_PER_QUERY = 500
+
+# Parámetros que SQL Server acepta como máximo en una sentencia parametrizada
+_MAX_QUERY_PARAMS = 2099
+
+# Tablas por consulta en los IN de INFORMATION_SCHEMA: potencia de dos, para que un bloque
+# completo no crezca al rellenarlo con _pad_in_list, y con margen bajo los 2100 parámetros
+_MAX_TABLES_PER_QUERY = 1024
+
+# Filas por lectura (cursor.arraysize) al recorrer resultados grandes con fetchmany
+_FETCH_ARRAYSIZE = 1000
+
+# Consultas a INFORMATION_SCHEMA compartidas por las herramientas de esquema.
+# El texto SQL es idéntico entre llamadas, lo que permite reutilizar la sentencia preparada.
+_Q_LIST_TABLES = """
+SELECT TABLE_NAME
+FROM INFORMATION_SCHEMA.TABLES
+WHERE TABLE_SCHEMA = ? AND TABLE_TYPE = 'BASE TABLE'
+ORDER BY TABLE_NAME
+"""
+
+
+def _pad_in_list(values: list) -> list:
+    """
+    Completa una lista de valores para un IN hasta la siguiente potencia de dos repitiendo el
+    último valor
+
+    Los duplicados no cambian el resultado del IN y así las consultas de tamaño variable se
+    reducen a unos pocos textos SQL distintos, que el servidor reutiliza desde su caché de planes.
+    """
+    size = 1 << (len(values) - 1).bit_length()
+    return values + values[-1:] * (size - len(values))
+
+
+def _schema_filter(by_schema: bool) -> str:
+    """Condición sobre TABLE_SCHEMA (un placeholder) para las consultas filtradas por esquema"""
+    return "TABLE_SCHEMA = ? AND " if by_schema else ""
+
+
+@functools.lru_cache(maxsize=64)
+def _q_columns(table_count: int, by_schema: bool) -> str:
+    """
+    Consulta de columnas para table_count tablas (un placeholder por tabla en el IN). Con
+    by_schema el primer placeholder es el esquema; sin él se buscan en todos los esquemas.
+
+    No hace falta un sondeo previo de existencia en sys.objects: en SQL Server la vista
+    filtra por nombre sobre sys.objects, así que una tabla inexistente ya cuesta una búsqueda
+    por índice, y el resultado vacío queda en la caché de esquemas.
+    """
+    placeholders = ",".join(["?"] * table_count)
+    return f"""
+SELECT 
+    TABLE_NAME,
+    COLUMN_NAME,
+    DATA_TYPE,
+    CHARACTER_MAXIMUM_LENGTH,
+    IS_NULLABLE,
+    ORDINAL_POSITION
+FROM INFORMATION_SCHEMA.COLUMNS
+WHERE {_schema_filter(by_schema)}TABLE_NAME IN ({placeholders})
+ORDER BY TABLE_NAME, ORDINAL_POSITION
+"""
+
+
+@functools.lru_cache(maxsize=64)
+def _q_column_previews(table_count: int) -> str:
+    """Consulta de las primeras columnas (RN <= ?) y el total por tabla para table_count tablas de cualquier esquema"""
+    placeholders = ",".join(["?"] * table_count)
+    return f"""
+SELECT 
+    TABLE_NAME,
+    COLUMN_NAME,
+    DATA_TYPE,
+    CHARACTER_MAXIMUM_LENGTH,
+    IS_NULLABLE,
+    ORDINAL_POSITION,
+    COLUMN_COUNT
+FROM (
+    SELECT 
+        TABLE_NAME,
+        COLUMN_NAME,
+        DATA_TYPE,
+        CHARACTER_MAXIMUM_LENGTH,
+        IS_NULLABLE,
+        ORDINAL_POSITION,
+        ROW_NUMBER() OVER (PARTITION BY TABLE_NAME ORDER BY ORDINAL_POSITION) AS RN,
+        COUNT(*) OVER (PARTITION BY TABLE_NAME) AS COLUMN_COUNT
+    FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_NAME IN ({placeholders})
+) AS c
+WHERE RN <= ?
+ORDER BY TABLE_NAME, ORDINAL_POSITION
+"""
+
+
+@functools.lru_cache(maxsize=64)
+def _q_roles(unit_count: int) -> str:
+    """Roles (excluyendo sys_admin) de unit_count unidades de negocio (un placeholder por unidad en el IN)"""
+    placeholders = ",".join(["?"] * unit_count)
+    return f"""
+SELECT business_unit, [code], [description], [application_type], [order_]
+FROM default_roles
+WHERE business_unit IN ({placeholders}) AND application_type != 'sys_admin'
+ORDER BY [order_], [description]
+"""
+
+
+@functools.lru_cache(maxsize=2)
+def _q_report_assignments(by_business_unit: bool) -> str:
+    """
+    Asignaciones de varios reportes, con el total por reporte. Los prefijos viajan en un único
+    parámetro JSON de filas [pos, report_prefix] (sin el límite de 2100 parámetros); con
+    by_business_unit se agrega un placeholder final para la unidad.
+    """
+    if by_business_unit:
+        where = "WHERE ar.business_unit = ?"
+        order_by = "p.pos, ar.[order], dr.[description]"
+    else:
+        where = ""
+        order_by = "p.pos, ar.business_unit, ar.[order], dr.[description]"
+    return f"""
+SELECT p.pos, ar.[role], ar.business_unit, ar.application_type, 
+       ar.[order], ar.custom_tag, ar.sales_office, ar.center_logistical,
+       dr.[description] as role_description,
+       COUNT(*) OVER (PARTITION BY p.pos) AS assignment_count
+FROM OPENJSON(?) WITH (pos INT '$[0]', report_prefix NVARCHAR(MAX) '$[1]') AS p
+JOIN assigned_reports ar ON ar.report_prefix = p.report_prefix
+LEFT JOIN default_roles dr ON ar.[role] = dr.[code] AND ar.business_unit = dr.business_unit
+{where}
+ORDER BY {order_by}
+"""
+
+
+# Columnas actualizables de assigned_reports, en el orden de los bits de la máscara de
+# _assignment_updates (bit 0 = application_type ... bit 4 = center_logistical)
+_ASSIGNMENT_UPDATE_COLUMNS = (
+    "application_type",
+    "[order]",
+    "custom_tag",
+    "sales_office",
+    "center_logistical",
+)
+
+# Columnas OUTPUT de los UPDATE de asignaciones
+_OUTPUT_UPDATED_ROLES = "inserted.[role], dr.[description] as role_description"
+_OUTPUT_PREVIOUS_VALUES = """deleted.application_type, deleted.[order], deleted.custom_tag,
+       deleted.sales_office, deleted.center_logistical,
+       dr.[description] as role_description"""
+
+
+@functools.lru_cache(maxsize=128)
+def _q_update_assignments(mask: int, role_count: int, output: str) -> str:
+    """
+    UPDATE de las columnas indicadas por mask para role_count roles de un reporte y unidad,
+    que retorna (OUTPUT) las columnas de output junto con la descripción del rol
+    """
+    set_clause = ", ".join(
+        f"{column} = ?"
+        for bit, column in enumerate(_ASSIGNMENT_UPDATE_COLUMNS)
+        if mask & (1 << bit)
+    )
+    placeholders = ",".join(["?"] * role_count)
+    return f"""
+UPDATE ar
+SET {set_clause}
+OUTPUT {output}
+FROM assigned_reports ar
+LEFT JOIN default_roles dr ON ar.[role] = dr.[code] AND ar.business_unit = dr.business_unit
+WHERE ar.business_unit = ? AND ar.report_prefix = ? AND ar.[role] IN ({placeholders})
+"""
+
+
+def _assignment_updates(*values) -> tuple[int, list]:
+    """
+    Máscara de columnas a actualizar y sus valores, omitiendo los None
+
+    Args:
+        values: Nuevos valores en el orden de _ASSIGNMENT_UPDATE_COLUMNS
+
+    Returns:
+        Tupla (máscara, valores del SET)
+    """
+    mask = 0
+    update_values = []
+    for bit, value in enumerate(values):
+        if value is not None:
+            mask |= 1 << bit
+            update_values.append(value)
+    return mask, update_values
+
+
+# MERGE que inserta en assigned_reports solo las asignaciones que no existen todavía y
+# retorna (OUTPUT) la posición de cada fila insertada. El lote completo viaja como un único
+# parámetro JSON (un arreglo por fila), sin el límite de 2100 parámetros por sentencia.
+# Los textos se leen como NVARCHAR(MAX): OPENJSON convierte como CAST y con un ancho fijo
+# recortaría en silencio los valores largos; así es la columna destino la que rechaza lo
+# que no cabe. OPENJSON requiere nivel de compatibilidad 130 (SQL Server 2016) o superior.
+_Q_MERGE_ASSIGNMENTS = """
+MERGE assigned_reports WITH (HOLDLOCK) AS tgt
+USING OPENJSON(?) WITH (
+    idx INT '$[0]',
+    [role] NVARCHAR(MAX) '$[1]',
+    report_prefix NVARCHAR(MAX) '$[2]',
+    business_unit NVARCHAR(MAX) '$[3]',
+    application_type NVARCHAR(MAX) '$[4]',
+    [order] INT '$[5]',
+    custom_tag NVARCHAR(MAX) '$[6]',
+    sales_office NVARCHAR(MAX) '$[7]',
+    center_logistical NVARCHAR(MAX) '$[8]'
+) AS src
+ON tgt.business_unit = src.business_unit
+   AND tgt.report_prefix = src.report_prefix
+   AND tgt.[role] = src.[role]
+WHEN NOT MATCHED THEN
+    INSERT (
+        [role], report_prefix, business_unit, application_type, [order], 
+        custom_tag, sales_office, center_logistical
+    )
+    VALUES (
+        src.[role], src.report_prefix, src.business_unit, src.application_type, src.[order],
+        src.custom_tag, src.sales_office, src.center_logistical
+    )
+OUTPUT src.idx;
+"""
+
+
+# Logger bajo el espacio "fastmcp", el único al que FastMCP le configura un handler
+logger = get_logger(__name__)
+
+# Préstamos de conexión de la llamada a herramienta en curso (True = reutilizada del pool).
+# La lista se comparte con los hilos de asyncio.to_thread, que copian el contexto.
+_TOOL_BORROWS: contextvars.ContextVar[list | None] = contextvars.ContextVar(
+    "_TOOL_BORROWS", default=None
+)
+
+
+class _ToolStatsMiddleware(Middleware):
+    """
+    Registra por cada llamada a herramienta su duración y cuántas veces tomó una conexión
+    del pool (y cuántas de ellas se abrieron nuevas)
+
+    Se cuentan préstamos de conexión, no sentencias: varias consultas sobre una misma
+    conexión prestada cuentan una sola vez.
+    """
+
+    async def on_call_tool(self, context, call_next):
+        borrows = []
+        token = _TOOL_BORROWS.set(borrows)
+        start = time.perf_counter()
+        try:
+            return await call_next(context)
+        finally:
+            _TOOL_BORROWS.reset(token)
+            logger.info(
+                "tool=%s prestamos_conexion=%d conexiones_nuevas=%d total_ms=%.1f",
+                context.message.name,
+                len(borrows),
+                borrows.count(False),
+                (time.perf_counter() - start) * 1000,
+            )
+
 
 # Inicializar FastMCP
 mcp = FastMCP("Ecosystem-Report-Generator")
+mcp.add_middleware(_ToolStatsMiddleware())
+
+
+def _is_reusable(conn: pyodbc.Connection, last_used: float) -> bool:
+    """
+    Indica si una conexión del pool puede entregarse de nuevo
+
+    Solo se hace el ping (SELECT 1) cuando la conexión lleva más de _CONN_MAX_IDLE_S
+    segundos sin usarse.
+    """
+    if conn.closed:
+        return False
+
+    try:
+        if time.monotonic() - last_used > _CONN_MAX_IDLE_S:
+            conn.timeout = _PING_TIMEOUT_S
+            conn.execute("SELECT 1").fetchval()
+            conn.timeout = 0
+        return True
+    except pyodbc.Error:
+        return False
 
 
 def get_db_connection(database_key: str = "default"):
     """
-    Crea y retorna una conexión a la base de datos especificada
+    Abre una nueva conexión a la base de datos especificada
+
+    Las herramientas no la llaman directamente: usan borrow_conn, que reutiliza las
+    conexiones del pool y solo recurre a esta función cuando no hay una libre.
 
     Args:
         database_key: Clave de la base de datos ('default' o 'INTEGRACION_CW_20_DEV')
 
     Returns:
-        Conexión a la base de datos
+        Conexión a la base de datos (con autocommit desactivado)
     """
-    if database_key not in DB_CONFIGS:
+    if database_key not in _db_configs():
         raise ValueError(f"Base de datos '{database_key}' no configurada")
 
-    config = DB_CONFIGS[database_key]
-    conn_string = (
-        f"DRIVER={config['driver']};"
-        f"SERVER={config['server']};"
-        f"DATABASE={config['database']};"
-        f"UID={config['username']};"
-        f"PWD={config['password']}"
-    )
-    return pyodbc.connect(conn_string)
+    conn = pyodbc.connect(_conn_strings()[database_key])
+    conn.autocommit = False
+    return conn
+
+
+def _conn_pool(database_key: str) -> queue.LifoQueue:
+    """Retorna el pool de conexiones libres de la base de datos, creándolo si no existe"""
+    if database_key not in _db_configs():
+        raise ValueError(f"Base de datos '{database_key}' no configurada")
+
+    with _CONN_LOCK:
+        return _CONN_POOLS.setdefault(database_key, queue.LifoQueue(_CONN_POOL_SIZE))
+
+
+def _release_conn(pool: queue.LifoQueue, conn: pyodbc.Connection):
+    """
+    Descarta la transacción pendiente y devuelve la conexión al pool (o la cierra si está lleno)
+
+    El rollback sirve también de chequeo al devolverla: si la conexión se cayó, falla y la
+    conexión se cierra en lugar de volver al pool.
+    """
+    if conn.closed:
+        return
+    try:
+        conn.rollback()
+        pool.put_nowait((conn, time.monotonic()))
+    except (pyodbc.Error, queue.Full):
+        # Cerrar una conexión caída también puede fallar; no debe ocultar el resultado del bloque
+        with contextlib.suppress(pyodbc.Error):
+            conn.close()
+
+
+@contextlib.contextmanager
+def borrow_conn(database_key: str = "default"):
+    """
+    Presta una conexión del pool durante el bloque with y la devuelve al salir
+
+    Al devolverla se hace rollback, de modo que lo que no se haya confirmado con
+    conn.commit() no pasa a la siguiente llamada. Los llamadores cierran solo el cursor.
+
+    Args:
+        database_key: Clave de la base de datos ('default' o 'INTEGRACION_CW_20_DEV')
+
+    Yields:
+        Conexión a la base de datos
+    """
+    pool = _conn_pool(database_key)
+
+    conn = None
+    reused = True
+    while conn is None:
+        try:
+            candidate, last_used = pool.get_nowait()
+        except queue.Empty:
+            conn = get_db_connection(database_key)
+            reused = False
+            break
+
+        if _is_reusable(candidate, last_used):
+            conn = candidate
+        else:
+            with contextlib.suppress(pyodbc.Error):
+                candidate.close()
+
+    borrows = _TOOL_BORROWS.get()
+    if borrows is not None:
+        borrows.append(reused)
+
+    try:
+        yield conn
+    finally:
+        _release_conn(pool, conn)
+
+
+def _schema_cache_get(key: tuple[str, str, str]):
+    """Retorna las filas cacheadas para la clave, o None si no existen o expiraron"""
+    entry = _SCHEMA_CACHE.get(key)
+    if entry is None or time.monotonic() - entry[0] > SCHEMA_CACHE_TTL_S:
+        return None
+    return entry[1]
+
+
+def _schema_cache_put(key: tuple[str, str, str], rows: list):
+    """
+    Guarda las filas en la caché de metadatos con el timestamp actual
+
+    Antes de guardar se descartan, desde la más antigua, las entradas expiradas y las que
+    exceden SCHEMA_CACHE_MAX_ENTRIES, de modo que las búsquedas de tablas inexistentes (que
+    también se cachean) no hacen crecer la caché sin límite.
+    """
+    with _SCHEMA_CACHE_LOCK:
+        _cache_put(
+            _SCHEMA_CACHE, key, rows, SCHEMA_CACHE_TTL_S, SCHEMA_CACHE_MAX_ENTRIES
+        )
+
+
+def _cache_put(cache: dict, key, value, ttl_s: float, max_entries: int):
+    """
+    Guarda un valor con el timestamp actual en una caché en orden de escritura
+
+    Antes de guardar se descartan desde el frente (las más antiguas) las entradas expiradas
+    y las que exceden max_entries. El llamador debe tener tomado el lock de la caché.
+    """
+    now = time.monotonic()
+    # Reinsertar la clave al final mantiene el orden por antigüedad
+    cache.pop(key, None)
+    while cache:
+        oldest = next(iter(cache))
+        if len(cache) < max_entries and now - cache[oldest][0] <= ttl_s:
+            break
+        del cache[oldest]
+    cache[key] = (now, value)
+
+
+def _columns_cache_key(database_key: str, table_name: str, schema: str = None) -> tuple:
+    """Clave de _SCHEMA_CACHE para las columnas de una tabla (en un esquema o en cualquiera)"""
+    view = f"COLUMNS.{schema}" if schema else "COLUMNS"
+    return (database_key, view, table_name.lower())
+
+
+def _fetch_columns(database_key: str, table_names: list, schema: str = None) -> dict:
+    """
+    Obtiene las columnas de varias tablas, consultando solo las que no están en caché
+
+    Args:
+        database_key: Base de datos a consultar ('default' o 'INTEGRACION_CW_20_DEV')
+        table_names: Lista de nombres de tablas
+        schema: Esquema de las tablas. Si es None, se buscan en todos los esquemas
+
+    Returns:
+        Diccionario {nombre de tabla solicitado: [(columna, tipo, longitud, nullable, posición), ...]}.
+        Las tablas inexistentes quedan con una lista vacía (y también se cachean).
+    """
+    columns_by_table = {}
+    misses = []
+    for table_name in table_names:
+        key = table_name.lower()
+        cached = _schema_cache_get(_columns_cache_key(database_key, key, schema))
+        if cached is None:
+            misses.append(table_name)
+        else:
+            columns_by_table[key] = cached
+
+    if misses:
+        with borrow_conn(database_key) as conn:
+            cursor = conn.cursor()
+
+            for start in range(0, len(misses), _MAX_TABLES_PER_QUERY):
+                chunk = misses[start : start + _MAX_TABLES_PER_QUERY]
+                padded = _pad_in_list(chunk)
+                cursor.execute(
+                    _q_columns(len(padded), bool(schema)),
+                    [schema, *padded] if schema else padded,
+                )
+                # Las filas se agrupan a medida que se leen del cursor, sin una lista intermedia
+                columns_by_table.update(
+                    _store_columns(database_key, chunk, cursor, schema)
+                )
+            cursor.close()
+
+    return {
+        table_name: columns_by_table[table_name.lower()] for table_name in table_names
+    }
+
+
+def _store_columns(
+    database_key: str, table_names: list, rows, schema: str = None
+) -> dict:
+    """
+    Agrupa por tabla las filas de INFORMATION_SCHEMA.COLUMNS y las guarda en la caché
+
+    Args:
+        database_key: Base de datos de la que provienen las filas
+        table_names: Tablas consultadas (las que no aparecen en rows se cachean vacías)
+        rows: Filas o cursor con (TABLE_NAME, COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH, IS_NULLABLE, ORDINAL_POSITION)
+        schema: Esquema por el que se filtró la consulta (None si no se filtró)
+
+    Returns:
+        Diccionario {tabla en minúsculas: [columnas]}
+    """
+    fetched = {table_name.lower(): [] for table_name in table_names}
+    for table_name, *column in rows:
+        fetched.setdefault(table_name.lower(), []).append(tuple(column))
+
+    for key, columns in fetched.items():
+        _schema_cache_put(_columns_cache_key(database_key, key, schema), columns)
+    return fetched
+
+
+def _fetch_column_previews(
+    database_key: str, table_names: list, limit: int = 5
+) -> dict:
+    """
+    Obtiene solo las primeras columnas de cada tabla y el total de columnas
+
+    Las tablas en caché se recortan en memoria; para el resto el límite se aplica en el
+    servidor con ROW_NUMBER(), de modo que solo viajan `limit` filas por tabla. Al ser
+    parciales, estos resultados no se guardan en la caché de esquemas.
+
+    Args:
+        database_key: Base de datos a consultar ('default' o 'INTEGRACION_CW_20_DEV')
+        table_names: Lista de nombres de tablas
+        limit: Número máximo de columnas por tabla
+
+    Returns:
+        Diccionario {nombre de tabla solicitado: ([primeras columnas], total de columnas)}.
+        Las tablas inexistentes quedan con ([], 0).
+    """
+    previews = {}
+    misses = []
+    for table_name in table_names:
+        key = table_name.lower()
+        cached = _schema_cache_get(_columns_cache_key(database_key, key))
+        if cached is None:
+            misses.append(table_name)
+        else:
+            previews[key] = (cached[:limit], len(cached))
+
+    if misses:
+        with borrow_conn(database_key) as conn:
+            cursor = conn.cursor()
+
+            fetched = {table_name.lower(): ([], 0) for table_name in misses}
+            for start in range(0, len(misses), _MAX_TABLES_PER_QUERY):
+                padded = _pad_in_list(misses[start : start + _MAX_TABLES_PER_QUERY])
+                cursor.execute(_q_column_previews(len(padded)), [*padded, limit])
+                for table_name, *column, column_count in cursor:
+                    columns, _ = fetched.setdefault(table_name.lower(), ([], 0))
+                    columns.append(tuple(column))
+                    fetched[table_name.lower()] = (columns, column_count)
+            cursor.close()
+        previews.update(fetched)
+
+    return {table_name: previews[table_name.lower()] for table_name in table_names}
+
+
+def _prefetch_columns_on_shared_servers(
+    db_keys: list, table_names: list, by_schema: bool = False
+):
+    """
+    Precarga en la caché las columnas de las bases de datos que comparten servidor
+
+    Por cada grupo de bases de datos en el mismo servidor y con las mismas credenciales
+    se envía un único UNION ALL sobre [db].INFORMATION_SCHEMA.COLUMNS por una sola conexión.
+    Si la consulta combinada falla (o superaría _MAX_QUERY_PARAMS parámetros), el grupo
+    queda sin precargar y cada base de datos se consulta luego por separado con _fetch_columns.
+
+    Args:
+        db_keys: Claves de las bases de datos a consultar (lista o tupla)
+        table_names: Lista de nombres de tablas
+        by_schema: Si es True, se buscan solo en el esquema configurado de cada base de datos
+    """
+    groups = {}
+    for db_key in db_keys:
+        schema = _db_schemas()[db_key] if by_schema else None
+        misses = [
+            table_name
+            for table_name in table_names
+            if _schema_cache_get(_columns_cache_key(db_key, table_name, schema)) is None
+        ]
+        if misses:
+            groups.setdefault(_server_groups()[db_key], []).append((db_key, misses))
+
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+
+        branches = []
+        params = []
+        for index, (db_key, misses) in enumerate(members):
+            database = _db_names()[db_key].replace("]", "]]")
+            placeholders = ("?," * len(misses))[:-1]
+            branches.append(
+                f"""
+            SELECT 
+                {index} AS DB_INDEX,
+                TABLE_NAME,
+                COLUMN_NAME,
+                DATA_TYPE,
+                CHARACTER_MAXIMUM_LENGTH,
+                IS_NULLABLE,
+                ORDINAL_POSITION
+            FROM [{database}].INFORMATION_SCHEMA.COLUMNS
+            WHERE {_schema_filter(by_schema)}TABLE_NAME IN ({placeholders})"""
+            )
+            if by_schema:
+                params.append(_db_schemas()[db_key])
+            params.extend(misses)
+
+        # Con demasiadas tablas el UNION ALL superaría el límite de parámetros; cada base de
+        # datos se consulta entonces por bloques con _fetch_columns
+        if len(params) > _MAX_QUERY_PARAMS:
+            continue
+
+        query = (
+            "\n            UNION ALL".join(branches)
+            + "\n            ORDER BY DB_INDEX, TABLE_NAME, ORDINAL_POSITION"
+        )
+
+        try:
+            with borrow_conn(members[0][0]) as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                rows_by_db = [[] for _ in members]
+                for index, *row in cursor:
+                    rows_by_db[index].append(row)
+                cursor.close()
+        except pyodbc.Error:
+            continue
+
+        for (db_key, misses), db_rows in zip(members, rows_by_db):
+            _store_columns(
+                db_key, misses, db_rows, _db_schemas()[db_key] if by_schema else None
+            )
+
+
+def _format_column(column: tuple) -> str:
+    """Formatea una columna como 'nombre: tipo(longitud) - NULL/NOT NULL'"""
+    # Acceso por índice: la tupla trae además ORDINAL_POSITION y no hace falta recortarla
+    max_length = column[2]
+    length_info = f"({max_length})" if max_length else ""
+    null_info = "NULL" if column[3] == "YES" else "NOT NULL"
+    return f"{column[0]}: {column[1]}{length_info} - {null_info}"
 
 
 @mcp.tool()
-def get_table_structure(table_name: str, database_key: str = "default") -> str:
+def get_table_structure(
+    table_name: str, database_key: str = "default", schema: str = None
+) -> str:
     """
     Obtiene la estructura de una tabla específica en la base de datos especificada
 
     Args:
         table_name: Nombre de la tabla a consultar
         database_key: Base de datos a consultar ('default' o 'INTEGRACION_CW_20_DEV')
+        schema: Esquema de la tabla (opcional). Si es None, se busca en todos los esquemas
 
     Returns:
         Estructura de la tabla con columnas y tipos de datos
     """
     try:
-        conn = get_db_connection(database_key)
-        cursor = conn.cursor()
-
-        query = """
-        SELECT 
-            COLUMN_NAME,
-            DATA_TYPE,
-            CHARACTER_MAXIMUM_LENGTH,
-            IS_NULLABLE
-        FROM INFORMATION_SCHEMA.COLUMNS
-        WHERE TABLE_NAME = ?
-        ORDER BY ORDINAL_POSITION
-        """
-
-        cursor.execute(query, table_name)
-        columns = cursor.fetchall()
+        columns = _fetch_columns(database_key, [table_name], schema)[table_name]
 
         if not columns:
-            return f"⚠️ No se encontró la tabla '{table_name}' en la base de datos '{DB_CONFIGS[database_key]['database']}'"
+            return f"⚠️ No se encontró la tabla '{table_name}' en la base de datos '{_db_names()[database_key]}'"
 
-        result = f"📋 Estructura de la tabla: {table_name}\n"
-        result += f"🗄️ Base de datos: {DB_CONFIGS[database_key]['database']}\n\n"
+        parts = [
+            f"📋 Estructura de la tabla: {table_name}\n",
+            f"🗄️ Base de datos: {_db_names()[database_key]}\n\n",
+        ]
         for col in columns:
-            col_name, data_type, max_length, nullable = col
-            length_info = f"({max_length})" if max_length else ""
-            null_info = "NULL" if nullable == "YES" else "NOT NULL"
-            result += f"  • {col_name}: {data_type}{length_info} - {null_info}\n"
+            parts.append(f"  • {_format_column(col)}\n")
 
-        conn.close()
-        return result
+        return "".join(parts)
 
     except Exception as e:
         return f"❌ Error al obtener estructura: {str(e)}"
@@ -114,31 +865,169 @@ def list_tables(schema: str = "dbo", database_key: str = "default") -> str:
         Lista de tablas disponibles
     """
     try:
-        conn = get_db_connection(database_key)
-        cursor = conn.cursor()
+        cache_key = (database_key, "TABLES", schema)
+        tables = _schema_cache_get(cache_key)
 
-        query = """
-        SELECT TABLE_NAME
-        FROM INFORMATION_SCHEMA.TABLES
-        WHERE TABLE_SCHEMA = ? AND TABLE_TYPE = 'BASE TABLE'
-        ORDER BY TABLE_NAME
-        """
+        if tables is None:
+            with borrow_conn(database_key) as conn:
+                cursor = conn.cursor()
 
-        cursor.execute(query, schema)
-        tables = cursor.fetchall()
+                cursor.execute(_Q_LIST_TABLES, schema)
+                tables = [table[0] for table in cursor.fetchall()]
+                cursor.close()
+            _schema_cache_put(cache_key, tables)
 
-        result = f"📚 Tablas disponibles en el esquema '{schema}'\n"
-        result += f"🗄️ Base de datos: {DB_CONFIGS[database_key]['database']}\n\n"
+        parts = [
+            f"📚 Tablas disponibles en el esquema '{schema}'\n",
+            f"🗄️ Base de datos: {_db_names()[database_key]}\n\n",
+        ]
         for table in tables:
-            result += f"  • {table[0]}\n"
+            parts.append(f"  • {table}\n")
 
-        conn.close()
-        return result
+        return "".join(parts)
 
     except Exception as e:
         return f"❌ Error al listar tablas: {str(e)}"
 
 
+@mcp.tool()
+def invalidate_schema_cache(database_key: str = None) -> str:
+    """
+    Invalida la caché de estructuras y listados de tablas para forzar una nueva consulta
+
+    Args:
+        database_key: Base de datos a invalidar ('default' o 'INTEGRACION_CW_20_DEV'). Si es None, invalida todas
+
+    Returns:
+        Cantidad de entradas eliminadas de la caché
+    """
+    if database_key is not None and database_key not in _db_configs():
+        return f"❌ Base de datos no válida: {database_key}. Disponibles: {', '.join(_db_keys())}"
+
+    with _SCHEMA_CACHE_LOCK:
+        keys = [
+            key
+            for key in _SCHEMA_CACHE
+            if database_key is None or key[0] == database_key
+        ]
+        for key in keys:
+            del _SCHEMA_CACHE[key]
+
+    scope = _db_names()[database_key] if database_key else "todas las bases de datos"
+    return (
+        f"🧹 Caché de esquemas invalidada para {scope}: {len(keys)} entradas eliminadas"
+    )
+
+
+@mcp.tool()
+def invalidate_roles_cache(business_unit: str = None) -> str:
+    """
+    Invalida la caché de default_roles para que las asignaciones vean los roles actuales
+
+    Args:
+        business_unit: Unidad de negocio a invalidar. Si es None, invalida todas
+
+    Returns:
+        Cantidad de entradas eliminadas de la caché
+    """
+    with _ROLES_CACHE_LOCK:
+        if business_unit is None:
+            removed = len(_ROLES_CACHE)
+            _ROLES_CACHE.clear()
+        else:
+            removed = int(
+                _ROLES_CACHE.pop(_roles_cache_key(business_unit), None) is not None
+            )
+
+    scope = f"la unidad {business_unit}" if business_unit else "todas las unidades"
+    return f"🧹 Caché de roles invalidada para {scope}: {removed} entradas eliminadas"
+
+
+def _bind_business_unit(query: str) -> tuple[str, int]:
+    """
+    Reemplaza por ? cada @business_unit que no esté dentro de un literal o un comentario
+
+    Returns:
+        Tupla (query con placeholders, cantidad de placeholders)
+    """
+    occurrences = 0
+
+    def replace(match):
+        nonlocal occurrences
+        if match.group(2):
+            occurrences += 1
+            return "?"
+        return match.group(0)
+
+    return _SQL_TOKEN_RE.sub(replace, query), occurrences
+
+
+def _strip_sql_comments(query: str) -> str:
+    """Reemplaza por un espacio los comentarios de una query, sin tocar los literales de texto"""
+    return _SQL_TOKEN_RE.sub(
+        lambda match: (
+            " " if match.group(0).startswith(("--", "/*")) else match.group(0)
+        ),
+        query,
+    )
+
+
+def _count_query(query: str) -> str | None:
+    """
+    Arma el SELECT COUNT(*) de una query (sin comentarios), o None si no puede ir como subconsulta
+
+    Un ORDER BY del nivel superior, habitual al final de las queries de reportes, no se acepta
+    en una subconsulta y no cambia el total, así que se recorta (salvo con TOP u OFFSET, donde
+    sí es válido). Las CTE (WITH), varias sentencias, OPTION y FOR XML/JSON no se pueden
+    envolver. Los ORDER BY dentro de OVER (...) o de subconsultas no cuentan.
+    """
+    query = query.strip().rstrip(";").rstrip()
+
+    # Enmascarar (con el mismo largo) los literales y el contenido de los paréntesis, para
+    # que las posiciones del nivel superior coincidan con las de la query original
+    code = _SQL_STRING_LITERAL_RE.sub(lambda match: "_" * len(match.group(0)), query)
+    nested = 1
+    while nested:
+        code, nested = _SQL_PARENTHESES_RE.subn(
+            lambda match: "_" * len(match.group(0)), code
+        )
+
+    if _NOT_A_SUBQUERY_RE.search(code):
+        return None
+
+    order_by = None
+    for order_by in _ORDER_BY_RE.finditer(code):
+        pass
+    if order_by is not None and not _KEEPS_ORDER_BY_RE.search(code):
+        query = query[: order_by.start()].rstrip()
+
+    # La query va en sus propias líneas para que nada en ella cierre el paréntesis
+    return f"SELECT COUNT(*) FROM (\n{query}\n) AS test_query"
+
+
+def _count_rows(cursor, fetched: int, query: str, params: tuple) -> int:
+    """
+    Cuenta las filas de una query de la que ya se leyeron `fetched` filas del cursor abierto
+
+    Si la query puede ir como subconsulta (ver _count_query), el total sale de un
+    SELECT COUNT(*) y el resto de las filas no viaja al cliente. Si no, se sigue leyendo el
+    mismo cursor por bloques, sin volver a ejecutar la query ni materializar las filas. Solo
+    si el servidor rechaza el SELECT COUNT(*) se ejecuta la query de nuevo para contarla.
+    """
+    cursor.arraysize = _FETCH_ARRAYSIZE
+    query = _strip_sql_comments(query)
+    count_query = _count_query(query)
+    if count_query is None:
+        return fetched + sum(len(chunk) for chunk in iter(cursor.fetchmany, []))
+
+    try:
+        cursor.execute(count_query, params)
+        return cursor.fetchval()
+    except pyodbc.Error:
+        cursor.execute(query, params)
+        return sum(len(chunk) for chunk in iter(cursor.fetchmany, []))
+
+
 @mcp.tool()
 def test_query(query: str, business_unit: str, database_key: str = "default") -> str:
     """
@@ -156,32 +1045,53 @@ def test_query(query: str, business_unit: str, database_key: str = "default") ->
         if "@business_unit" not in query:
             return "⚠️ La query debe incluir el parámetro @business_unit"
 
-        conn = get_db_connection(database_key)
-        cursor = conn.cursor()
+        # Un @business_unit dentro de un literal de texto no puede enlazarse como parámetro
+        if any(
+            match.group(1) and _BUSINESS_UNIT_RE.search(match.group(1))
+            for match in _SQL_TOKEN_RE.finditer(query)
+        ):
+            return "⚠️ El parámetro @business_unit no puede aparecer dentro de un literal de texto"
+
+        # Rechazar valores inválidos antes de abrir la conexión
+        if not _BUSINESS_UNIT_VALUE_RE.fullmatch(business_unit):
+            return "⚠️ business_unit inválido: solo se permiten letras, números, '_' y '-' (máximo 20 caracteres)"
+
+        # Enlazar @business_unit como parámetro para que SQL Server reutilice el plan
+        # (los literales y comentarios se dejan tal cual)
+        parameterized_query, occurrences = _bind_business_unit(query)
+        if occurrences == 0:
+            return "⚠️ La query debe incluir el parámetro @business_unit"
 
-        # Reemplazar el parámetro para la prueba
-        test_query = query.replace("@business_unit", f"'{business_unit}'")
+        with borrow_conn(database_key) as conn:
+            cursor = conn.cursor()
 
-        cursor.execute(test_query)
-        rows = cursor.fetchall()
+            params = (business_unit,) * occurrences
+            cursor.execute(parameterized_query, params)
 
-        if not rows:
-            return f"✅ Query ejecutada correctamente en {DB_CONFIGS[database_key]['database']} pero no retornó resultados"
+            # Traer solo las filas de la vista previa en lugar de todo el resultado
+            rows = cursor.fetchmany(5)
 
-        # Obtener nombres de columnas
-        columns = [column[0] for column in cursor.description]
+            if not rows:
+                return f"✅ Query ejecutada correctamente en {_db_names()[database_key]} pero no retornó resultados"
 
-        result = f"✅ Query ejecutada correctamente en {DB_CONFIGS[database_key]['database']}. Primeras 5 filas:"
-        result += " | ".join(columns) + "\n"
-        result += "-" * 80 + "\n"
+            # Obtener nombres de columnas
+            columns = [column[0] for column in cursor.description]
 
-        for row in rows[:5]:
-            result += " | ".join(str(val) for val in row) + "\n"
+            if len(rows) < 5:
+                total_rows = len(rows)
+            else:
+                total_rows = _count_rows(cursor, len(rows), parameterized_query, params)
 
-        result += f"\n📊 Total de registros: {len(rows)}"
+            parts = [
+                f"✅ Query ejecutada correctamente en {_db_names()[database_key]}. Primeras 5 filas:",
+                " | ".join(columns) + "\n",
+                "-" * 80 + "\n",
+            ]
+            parts.extend([" | ".join(map(str, row)) + "\n" for row in rows])
+            parts.append(f"\n📊 Total de registros: {total_rows}")
 
-        conn.close()
-        return result
+            cursor.close()
+        return "".join(parts)
 
     except Exception as e:
         return f"❌ Error al probar query: {str(e)}"
@@ -236,7 +1146,7 @@ def create_report(
         query_database_key = None
         if database_key is None:
             # Si la query menciona INTEGRACION_CW_20_DEV, la query apunta a esa base de datos
-            if "INTEGRACION_CW_20_DEV" in query.upper():
+            if _INTEGRACION_DB_RE.search(query):
                 query_database_key = "INTEGRACION_CW_20_DEV"
             else:
                 query_database_key = "default"
@@ -251,51 +1161,31 @@ def create_report(
         params_json = json.dumps(params_config)
 
         # El SP siempre se ejecuta en la base de datos por defecto (dev)
-        conn = get_db_connection("default")
-        cursor = conn.cursor()
-
-        sp_call = """
-        EXEC sp_ecosystem_create_columns_config
-            ?, -- @report_prefix
-            ?, -- @report_description
-            ?, -- @report_description_es
-            'report', -- @type
-            1, -- @table_number
-            ?, -- @query
-            ?, -- @params_config
-            ?, -- @is_detail
-            ?, -- @hasDetail
-            ?, -- @actionColumn
-            ?, -- @detail_prefix
-            ?, -- @detail_mode
-            ?, -- @open_another_tab
-            ?, -- @type_resource
-            ?, -- @columns_to_render
-            ?  -- default_for_all
-        """
-
-        cursor.execute(
-            sp_call,
-            (
-                report_prefix,
-                report_description_en,
-                report_description_es,
-                query,
-                params_json,
-                is_detail,
-                has_detail,
-                action_column,
-                detail_prefix,
-                detail_mode,
-                open_another_tab,
-                type_resource,
-                columns_to_render,
-                default_for_all,
-            ),
-        )
+        with borrow_conn("default") as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(
+                _SP_CREATE_COLUMNS_CONFIG,
+                (
+                    report_prefix,
+                    report_description_en,
+                    report_description_es,
+                    query,
+                    params_json,
+                    is_detail,
+                    has_detail,
+                    action_column,
+                    detail_prefix,
+                    detail_mode,
+                    open_another_tab,
+                    type_resource,
+                    columns_to_render,
+                    default_for_all,
+                ),
+            )
 
-        conn.commit()
-        conn.close()
+            conn.commit()
+            cursor.close()
 
         return f"""✅ Reporte creado exitosamente!
 
@@ -305,8 +1195,8 @@ def create_report(
   • Descripción (ES): {report_description_es}
   • Parámetros: {params_json}
   • Tipo de recurso: {type_resource}
-  • Query apunta a: {DB_CONFIGS[query_database_key]["database"]}
-  • SP ejecutado en: {DB_CONFIGS["default"]["database"]}
+  • Query apunta a: {_db_names()[query_database_key]}
+  • SP ejecutado en: {_db_names()["default"]}
 """
 
     except Exception as e:
@@ -341,65 +1231,48 @@ def assign_report_to_role(
         Resultado de la asignación
     """
     try:
-        conn = get_db_connection("default")
-        cursor = conn.cursor()
-
-        # Paso 1: Buscar el código del rol por descripción
-        role_query = """
-        SELECT [code], [description], [application_type]
-        FROM default_roles 
-        WHERE business_unit = ? AND [description] LIKE ? AND application_type != 'sys_admin'
-        """
-
-        cursor.execute(role_query, (business_unit, f"%{role_description}%"))
-        roles = cursor.fetchall()
+        # Resolver el rol con la misma búsqueda (y caché) que bulk_assign_reports_to_roles,
+        # para que una misma descripción elija siempre el mismo código
+        roles = _fetch_roles_by_description({(business_unit, role_description)})[
+            (business_unit, role_description)
+        ]
 
         if not roles:
             return f"❌ No se encontró ningún rol con descripción '{role_description}' para la unidad {business_unit} (excluyendo sys_admin)"
 
-        # Si hay múltiples roles, usar el primero
-        role_code, role_desc, role_app_type = roles[0]
-
-        warning_msg = ""
-        if len(roles) > 1:
-            warning_msg = f"⚠️ Se encontraron múltiples roles. Usando: {role_code} - {role_desc}\n\n"
+        # Si hay múltiples roles, se usa el primero
+        role_code, role_desc, _ = roles[0]
 
-        # Paso 2: Verificar si ya existe la asignación
-        check_query = """
-        SELECT COUNT(*) FROM assigned_reports 
-        WHERE business_unit = ? AND report_prefix = ? AND [role] = ?
-        """
+        with borrow_conn("default") as conn:
+            cursor = conn.cursor()
 
-        cursor.execute(check_query, (business_unit, report_prefix, role_code))
-        exists = cursor.fetchone()[0]
-
-        if exists > 0:
-            return f"⚠️ El reporte '{report_prefix}' ya está asignado al rol '{role_code}' para la unidad {business_unit}"
+            # El MERGE compartido solo inserta si la asignación no existe todavía
+            inserted = _merge_assignments(
+                cursor,
+                [
+                    (
+                        role_code,
+                        report_prefix,
+                        business_unit,
+                        application_type,
+                        order,
+                        custom_tag,
+                        sales_office,
+                        center_logistical,
+                    )
+                ],
+            )
 
-        # Paso 3: Insertar la nueva asignación
-        insert_query = """
-        INSERT INTO assigned_reports (
-            [role], report_prefix, business_unit, application_type, [order], 
-            custom_tag, sales_office, center_logistical
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """
+            if not inserted:
+                cursor.close()
+                return f"⚠️ El reporte '{report_prefix}' ya está asignado al rol '{role_code}' para la unidad {business_unit}"
 
-        cursor.execute(
-            insert_query,
-            (
-                role_code,
-                report_prefix,
-                business_unit,
-                application_type,
-                order,
-                custom_tag,
-                sales_office,
-                center_logistical,
-            ),
-        )
+            warning_msg = ""
+            if len(roles) > 1:
+                warning_msg = f"⚠️ Se encontraron múltiples roles. Usando: {role_code} - {role_desc}\n\n"
 
-        conn.commit()
-        conn.close()
+            conn.commit()
+            cursor.close()
 
         return f"""{warning_msg}✅ Reporte asignado exitosamente!
 
@@ -418,95 +1291,79 @@ def assign_report_to_role(
         return f"❌ Error al asignar reporte: {str(e)}"
 
 
-@mcp.tool()
-def get_table_structures_across_databases(table_names: list) -> str:
+def _describe_structures_in_db(db_key: str, table_names: list) -> str:
     """
-    Obtiene la estructura de múltiples tablas en todas las bases de datos configuradas
+    Construye el bloque de resultado de get_table_structures_across_databases para una base de datos
 
     Args:
+        db_key: Clave de la base de datos a consultar
         table_names: Lista de nombres de tablas a consultar
 
     Returns:
-        Estructura de las tablas en todas las bases de datos
+        Texto con las estructuras encontradas (o el error) en esa base de datos
     """
+    db_name = _db_names()[db_key]
     try:
-        if not table_names:
-            return "⚠️ No se proporcionaron nombres de tablas"
+        columns_by_table = _fetch_columns(db_key, table_names)
 
-        result = "🔍 Buscando estructuras de tablas en todas las bases de datos:\n"
-        result += f"📋 Tablas solicitadas: {', '.join(table_names)}\n\n"
+        parts = [f"🗄️ Base de datos: {db_name}\n"]
 
-        for db_key, db_config in DB_CONFIGS.items():
-            try:
-                conn = get_db_connection(db_key)
-                cursor = conn.cursor()
+        if any(columns_by_table.values()):
+            # Mostrar tablas encontradas
+            for table_name in table_names:
+                columns = columns_by_table[table_name]
+                if columns:
+                    parts.append(f"  ✅ {table_name}:\n")
+                    for col in columns:
+                        parts.append(f"    • {_format_column(col)}\n")
+                else:
+                    parts.append(f"  ❌ {table_name}: No encontrada\n")
+        else:
+            parts.append("  ❌ Ninguna tabla encontrada\n")
 
-                # Crear placeholders para la consulta IN
-                placeholders = ",".join(["?" for _ in table_names])
-
-                query = f"""
-                SELECT 
-                    TABLE_NAME,
-                    COLUMN_NAME,
-                    DATA_TYPE,
-                    CHARACTER_MAXIMUM_LENGTH,
-                    IS_NULLABLE,
-                    ORDINAL_POSITION
-                FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE TABLE_NAME IN ({placeholders})
-                ORDER BY TABLE_NAME, ORDINAL_POSITION
-                """
+        parts.append("\n")
+        return "".join(parts)
+
+    except Exception as e:
+        return f"⚠️ Error al consultar {db_name}: {str(e)}\n\n"
 
-                cursor.execute(query, table_names)
-                columns = cursor.fetchall()
 
-                result += f"🗄️ Base de datos: {db_config['database']}\n"
+@mcp.tool()
+async def get_table_structures_across_databases(table_names: list) -> str:
+    """
+    Obtiene la estructura de múltiples tablas en todas las bases de datos configuradas
 
-                if columns:
-                    # Agrupar resultados por tabla
-                    tables_data = {}
-                    for col in columns:
-                        (
-                            table_name,
-                            col_name,
-                            data_type,
-                            max_length,
-                            nullable,
-                            ordinal,
-                        ) = col
-                        if table_name not in tables_data:
-                            tables_data[table_name] = []
-
-                        length_info = f"({max_length})" if max_length else ""
-                        null_info = "NULL" if nullable == "YES" else "NOT NULL"
-                        tables_data[table_name].append(
-                            {
-                                "name": col_name,
-                                "type": data_type,
-                                "length": length_info,
-                                "nullable": null_info,
-                                "position": ordinal,
-                            }
-                        )
+    Args:
+        table_names: Lista de nombres de tablas a consultar
 
-                    # Mostrar tablas encontradas
-                    for table_name in table_names:
-                        if table_name in tables_data:
-                            result += f"  ✅ {table_name}:\n"
-                            for col in tables_data[table_name]:
-                                result += f"    • {col['name']}: {col['type']}{col['length']} - {col['nullable']}\n"
-                        else:
-                            result += f"  ❌ {table_name}: No encontrada\n"
-                else:
-                    result += "  ❌ Ninguna tabla encontrada\n"
+    Returns:
+        Estructura de las tablas en todas las bases de datos
+    """
+    try:
+        if not table_names:
+            return "⚠️ No se proporcionaron nombres de tablas"
 
-                result += "\n"
-                conn.close()
+        parts = [
+            "🔍 Buscando estructuras de tablas en todas las bases de datos:\n",
+            f"📋 Tablas solicitadas: {', '.join(table_names)}\n\n",
+        ]
 
-            except Exception as e:
-                result += f"⚠️ Error al consultar {db_config['database']}: {str(e)}\n\n"
+        # Las bases de datos que comparten servidor se resuelven con una sola consulta UNION ALL
+        await asyncio.to_thread(
+            _prefetch_columns_on_shared_servers, _db_keys(), table_names
+        )
+
+        # El resto se consulta en paralelo en hilos (pyodbc libera el GIL durante la consulta),
+        # sin bloquear el event loop del servidor MCP
+        fragments = await asyncio.gather(
+            *(
+                asyncio.to_thread(_describe_structures_in_db, db_key, table_names)
+                for db_key in _db_keys()
+            )
+        )
+        parts.extend(fragments)
 
-        return result
+        return "".join(parts)
 
     except Exception as e:
         return f"❌ Error general: {str(e)}"
@@ -514,7 +1371,7 @@ def get_table_structures_across_databases(table_names: list) -> str:
 
 @mcp.tool()
 def get_multiple_table_structures(
-    table_names: list, database_key: str = "default"
+    table_names: list, database_key: str = "default", schema: str = None
 ) -> str:
     """
     Obtiene la estructura de múltiples tablas de una vez
@@ -522,6 +1379,7 @@ def get_multiple_table_structures(
     Args:
         table_names: Lista de nombres de tablas a consultar
         database_key: Base de datos a consultar ('default' o 'INTEGRACION_CW_20_DEV')
+        schema: Esquema de las tablas (opcional). Si es None, se buscan en todos los esquemas
 
     Returns:
         Estructura de todas las tablas solicitadas
@@ -530,74 +1388,72 @@ def get_multiple_table_structures(
         if not table_names:
             return "⚠️ No se proporcionaron nombres de tablas"
 
-        conn = get_db_connection(database_key)
-        cursor = conn.cursor()
+        columns_by_table = _fetch_columns(database_key, table_names, schema)
 
-        # Crear placeholders para la consulta IN
-        placeholders = ",".join(["?" for _ in table_names])
-
-        query = f"""
-        SELECT 
-            TABLE_NAME,
-            COLUMN_NAME,
-            DATA_TYPE,
-            CHARACTER_MAXIMUM_LENGTH,
-            IS_NULLABLE,
-            ORDINAL_POSITION
-        FROM INFORMATION_SCHEMA.COLUMNS
-        WHERE TABLE_NAME IN ({placeholders})
-        ORDER BY TABLE_NAME, ORDINAL_POSITION
-        """
-
-        cursor.execute(query, table_names)
-        columns = cursor.fetchall()
-
-        if not columns:
+        if not any(columns_by_table.values()):
             tables_str = ", ".join(table_names)
-            return f"⚠️ No se encontraron las tablas '{tables_str}' en la base de datos '{DB_CONFIGS[database_key]['database']}'"
-
-        # Agrupar resultados por tabla
-        tables_data = {}
-        for col in columns:
-            table_name, col_name, data_type, max_length, nullable, ordinal = col
-            if table_name not in tables_data:
-                tables_data[table_name] = []
-
-            length_info = f"({max_length})" if max_length else ""
-            null_info = "NULL" if nullable == "YES" else "NOT NULL"
-            tables_data[table_name].append(
-                {
-                    "name": col_name,
-                    "type": data_type,
-                    "length": length_info,
-                    "nullable": null_info,
-                    "position": ordinal,
-                }
-            )
+            return f"⚠️ No se encontraron las tablas '{tables_str}' en la base de datos '{_db_names()[database_key]}'"
 
         # Construir resultado
-        result = (
-            f"📋 Estructuras de tablas en {DB_CONFIGS[database_key]['database']}:\n\n"
-        )
+        parts = [f"📋 Estructuras de tablas en {_db_names()[database_key]}:\n\n"]
 
         for table_name in table_names:
-            if table_name in tables_data:
-                result += f"🗂️ Tabla: {table_name}\n"
-                for col in tables_data[table_name]:
-                    result += f"  • {col['name']}: {col['type']}{col['length']} - {col['nullable']}\n"
-                result += "\n"
+            columns = columns_by_table[table_name]
+            if columns:
+                parts.append(f"🗂️ Tabla: {table_name}\n")
+                for col in columns:
+                    parts.append(f"  • {_format_column(col)}\n")
+                parts.append("\n")
             else:
-                result += f"❌ Tabla '{table_name}' no encontrada\n\n"
+                parts.append(f"❌ Tabla '{table_name}' no encontrada\n\n")
 
-        conn.close()
-        return result
+        return "".join(parts)
 
     except Exception as e:
         return f"❌ Error al obtener estructuras múltiples: {str(e)}"
 
 
+def _query_one_db(db_key: str, table_names: list) -> dict:
+    """
+    Busca las tablas en una base de datos para bulk_search_tables_in_databases
+
+    Args:
+        db_key: Clave de la base de datos a consultar
+        table_names: Lista de nombres de tablas a buscar
+
+    Returns:
+        Diccionario con found_tables ({tabla: (primeras columnas, total)}), found_count,
+        total_columns (y error si falló la consulta)
+    """
+    try:
+        previews = _fetch_column_previews(db_key, table_names)
+
+        # Procesar resultados para esta base de datos
+        found_tables = {
+            table_name: preview
+            for table_name, preview in previews.items()
+            if preview[1]
+        }
+
+        return {
+            "found_tables": found_tables,
+            "found_count": len(found_tables),
+            "total_columns": sum(
+                column_count for _, column_count in found_tables.values()
+            ),
+        }
+
+    except Exception as e:
+        return {
+            "error": str(e),
+            "found_tables": {},
+            "found_count": 0,
+            "total_columns": 0,
+        }
+
+
 @mcp.tool()
-def bulk_search_tables_in_databases(
+async def bulk_search_tables_in_databases(
     table_names: list, database_keys: list = None
 ) -> str:
     """
@@ -617,130 +1473,72 @@ def bulk_search_tables_in_databases(
 
         # Si no se especifican bases de datos, usar todas las configuradas
         if database_keys is None:
-            database_keys = list(DB_CONFIGS.keys())
+            database_keys = list(_db_keys())
 
         # Validar que las bases de datos existan
-        invalid_dbs = [db for db in database_keys if db not in DB_CONFIGS]
+        invalid_dbs = [db for db in database_keys if db not in _db_configs()]
         if invalid_dbs:
-            return f"❌ Bases de datos no válidas: {', '.join(invalid_dbs)}. Disponibles: {', '.join(DB_CONFIGS.keys())}"
-
-        # Crear placeholders para la consulta IN
-        placeholders = ",".join(["?" for _ in table_names])
-
-        # Buscar en cada base de datos
-        all_results = {}
-        total_found = 0
-
-        for db_key in database_keys:
-            try:
-                # Conectar a la base de datos específica
-                db_conn = get_db_connection(db_key)
-                db_cursor = db_conn.cursor()
-
-                query = f"""
-                SELECT 
-                    TABLE_NAME,
-                    COLUMN_NAME,
-                    DATA_TYPE,
-                    CHARACTER_MAXIMUM_LENGTH,
-                    IS_NULLABLE,
-                    ORDINAL_POSITION
-                FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE TABLE_NAME IN ({placeholders})
-                ORDER BY TABLE_NAME, ORDINAL_POSITION
-                """
-
-                db_cursor.execute(query, table_names)
-                columns = db_cursor.fetchall()
+            return f"❌ Bases de datos no válidas: {', '.join(invalid_dbs)}. Disponibles: {', '.join(_db_keys())}"
 
-                # Procesar resultados para esta base de datos
-                db_results = {}
-                found_tables = set()
-
-                for col in columns:
-                    (
-                        table_name,
-                        col_name,
-                        data_type,
-                        max_length,
-                        nullable,
-                        ordinal,
-                    ) = col
-
-                    if table_name not in db_results:
-                        db_results[table_name] = []
-                        found_tables.add(table_name)
-
-                    length_info = f"({max_length})" if max_length else ""
-                    null_info = "NULL" if nullable == "YES" else "NOT NULL"
-                    db_results[table_name].append(
-                        {
-                            "name": col_name,
-                            "type": data_type,
-                            "length": length_info,
-                            "nullable": null_info,
-                            "position": ordinal,
-                        }
-                    )
-
-                all_results[db_key] = {
-                    "found_tables": db_results,
-                    "found_count": len(found_tables),
-                    "total_columns": len(columns),
-                }
-                total_found += len(found_tables)
-
-                db_conn.close()
+        # Buscar en cada base de datos en paralelo, un hilo por base de datos
+        db_results = await asyncio.gather(
+            *(
+                asyncio.to_thread(_query_one_db, db_key, table_names)
+                for db_key in database_keys
+            )
+        )
+        all_results = dict(zip(database_keys, db_results))
 
-            except Exception as e:
-                all_results[db_key] = {
-                    "error": str(e),
-                    "found_tables": {},
-                    "found_count": 0,
-                    "total_columns": 0,
-                }
+        total_found = sum(
+            db_result["found_count"] for db_result in all_results.values()
+        )
 
         # Construir resultado
-        result = "🔍 Búsqueda masiva de tablas completada!\n\n"
-        result += f"📋 Tablas buscadas: {', '.join(table_names)}\n"
-        result += f"🗄️ Bases de datos consultadas: {', '.join(database_keys)}\n"
-        result += f"📊 Total de tablas encontradas: {total_found}\n\n"
+        parts = [
+            "🔍 Búsqueda masiva de tablas completada!\n\n",
+            f"📋 Tablas buscadas: {', '.join(table_names)}\n",
+            f"🗄️ Bases de datos consultadas: {', '.join(database_keys)}\n",
+            f"📊 Total de tablas encontradas: {total_found}\n\n",
+        ]
 
         # Mostrar resultados por base de datos
         for db_key in database_keys:
-            db_config = DB_CONFIGS[db_key]
             db_result = all_results[db_key]
 
-            result += f"🗄️ Base de datos: {db_config['database']}\n"
+            parts.append(f"🗄️ Base de datos: {_db_names()[db_key]}\n")
 
             if "error" in db_result:
-                result += f"  ❌ Error: {db_result['error']}\n\n"
+                parts.append(f"  ❌ Error: {db_result['error']}\n\n")
                 continue
 
             if db_result["found_count"] == 0:
-                result += "  ❌ Ninguna tabla encontrada\n\n"
+                parts.append("  ❌ Ninguna tabla encontrada\n\n")
                 continue
 
-            result += f"  ✅ Tablas encontradas: {db_result['found_count']} | Columnas totales: {db_result['total_columns']}\n"
+            parts.append(
+                f"  ✅ Tablas encontradas: {db_result['found_count']} | Columnas totales: {db_result['total_columns']}\n"
+            )
 
             # Mostrar cada tabla encontrada
             for table_name in table_names:
                 if table_name in db_result["found_tables"]:
-                    columns = db_result["found_tables"][table_name]
-                    result += f"    📋 {table_name} ({len(columns)} columnas):\n"
+                    columns, column_count = db_result["found_tables"][table_name]
+                    parts.append(f"    📋 {table_name} ({column_count} columnas):\n")
 
-                    for col in columns[:5]:  # Mostrar solo las primeras 5 columnas
-                        result += f"      • {col['name']}: {col['type']}{col['length']} - {col['nullable']}\n"
+                    for col in columns:  # Solo llegan las primeras 5 columnas
+                        parts.append(f"      • {_format_column(col)}\n")
 
-                    if len(columns) > 5:
-                        result += f"      ... y {len(columns) - 5} columnas más\n"
+                    if column_count > len(columns):
+                        parts.append(
+                            f"      ... y {column_count - len(columns)} columnas más\n"
+                        )
                 else:
-                    result += f"    ❌ {table_name}: No encontrada\n"
+                    parts.append(f"    ❌ {table_name}: No encontrada\n")
 
-            result += "\n"
+            parts.append("\n")
 
         # Resumen final
-        result += "📈 Resumen por tabla:\n"
+        parts.append("📈 Resumen por tabla:\n")
         for table_name in table_names:
             found_in_dbs = []
             for db_key in database_keys:
@@ -748,21 +1546,120 @@ def bulk_search_tables_in_databases(
                     db_key in all_results
                     and table_name in all_results[db_key]["found_tables"]
                 ):
-                    found_in_dbs.append(DB_CONFIGS[db_key]["database"])
+                    found_in_dbs.append(_db_names()[db_key])
 
             if found_in_dbs:
-                result += (
+                parts.append(
                     f"  ✅ {table_name}: Encontrada en {', '.join(found_in_dbs)}\n"
                 )
             else:
-                result += f"  ❌ {table_name}: No encontrada en ninguna base de datos\n"
+                parts.append(
+                    f"  ❌ {table_name}: No encontrada en ninguna base de datos\n"
+                )
 
-        return result
+        return "".join(parts)
 
     except Exception as e:
         return f"❌ Error en búsqueda masiva: {str(e)}"
 
 
+def _iter_valid_rows(reports_data: list, failed_reports: list):
+    """
+    Valida los reportes de bulk_create_reports y genera los parámetros del SP uno a uno
+
+    Los reportes inválidos se agregan a failed_reports, sin materializar una lista
+    intermedia con todas las filas.
+
+    Args:
+        reports_data: Lista de diccionarios con datos de reportes
+        failed_reports: Lista donde se acumulan los reportes con error de validación
+
+    Yields:
+        Tupla (información del reporte, parámetros para _SP_CREATE_COLUMNS_CONFIG)
+    """
+    for i, report_data in enumerate(reports_data, 1):
+        try:
+            # Validar campos requeridos
+            required_fields = [
+                "report_prefix",
+                "report_description_en",
+                "report_description_es",
+                "query",
+            ]
+            missing_fields = [
+                field for field in required_fields if field not in report_data
+            ]
+
+            if missing_fields:
+                failed_reports.append(
+                    {
+                        "index": i,
+                        "report_prefix": report_data.get("report_prefix", "N/A"),
+                        "error": f"Campos faltantes: {', '.join(missing_fields)}",
+                    }
+                )
+                continue
+
+            # Validar que la query incluya @business_unit
+            if "@business_unit" not in report_data["query"]:
+                failed_reports.append(
+                    {
+                        "index": i,
+                        "report_prefix": report_data["report_prefix"],
+                        "error": "La query debe incluir el parámetro @business_unit",
+                    }
+                )
+                continue
+
+            # Detectar automáticamente la base de datos si no se especifica
+            query_database_key = report_data.get("database_key")
+            if query_database_key is None:
+                if _INTEGRACION_DB_RE.search(report_data["query"]):
+                    query_database_key = "INTEGRACION_CW_20_DEV"
+                else:
+                    query_database_key = "default"
+
+            # Construir params_config
+            params_config = {"business_unit": "NVARCHAR(20)"}
+            if report_data.get("additional_params"):
+                params_config.update(report_data["additional_params"])
+
+            params_json = json.dumps(params_config)
+
+            report_info = {
+                "index": i,
+                "report_prefix": report_data["report_prefix"],
+                "query_database": _db_names()[query_database_key],
+                "sp_database": _db_names()["default"],
+            }
+            params = (
+                report_data["report_prefix"],
+                report_data["report_description_en"],
+                report_data["report_description_es"],
+                report_data["query"],
+                params_json,
+                report_data.get("is_detail", 0),
+                report_data.get("has_detail"),
+                report_data.get("action_column"),
+                report_data.get("detail_prefix"),
+                report_data.get("detail_mode"),
+                report_data.get("open_another_tab"),
+                report_data.get("type_resource", "table"),
+                report_data.get("columns_to_render"),
+                report_data.get("default_for_all", 0),
+            )
+            yield report_info, params
+
+        except Exception as e:
+            failed_reports.append(
+                {
+                    "index": i,
+                    "report_prefix": report_data.get("report_prefix", "N/A"),
+                    "error": str(e),
+                }
+            )
+
+
 @mcp.tool()
 def bulk_create_reports(reports_data: list) -> str:
     """
@@ -793,148 +1690,223 @@ def bulk_create_reports(reports_data: list) -> str:
         if not reports_data:
             return "⚠️ No se proporcionaron datos de reportes para crear"
 
-        conn = get_db_connection("default")
-        cursor = conn.cursor()
-
         successful_reports = []
-        failed_reports = []
-        total_created = 0
-
-        for i, report_data in enumerate(reports_data, 1):
-            try:
-                # Validar campos requeridos
-                required_fields = [
-                    "report_prefix",
-                    "report_description_en",
-                    "report_description_es",
-                    "query",
-                ]
-                missing_fields = [
-                    field for field in required_fields if field not in report_data
-                ]
-
-                if missing_fields:
-                    failed_reports.append(
-                        {
-                            "index": i,
-                            "report_prefix": report_data.get("report_prefix", "N/A"),
-                            "error": f"Campos faltantes: {', '.join(missing_fields)}",
-                        }
-                    )
-                    continue
-
-                # Validar que la query incluya @business_unit
-                if "@business_unit" not in report_data["query"]:
-                    failed_reports.append(
-                        {
-                            "index": i,
-                            "report_prefix": report_data["report_prefix"],
-                            "error": "La query debe incluir el parámetro @business_unit",
-                        }
-                    )
-                    continue
-
-                # Detectar automáticamente la base de datos si no se especifica
-                query_database_key = report_data.get("database_key")
-                if query_database_key is None:
-                    if "INTEGRACION_CW_20_DEV" in report_data["query"].upper():
-                        query_database_key = "INTEGRACION_CW_20_DEV"
-                    else:
-                        query_database_key = "default"
-
-                # Construir params_config
-                params_config = {"business_unit": "NVARCHAR(20)"}
-                if report_data.get("additional_params"):
-                    params_config.update(report_data["additional_params"])
-
-                params_json = json.dumps(params_config)
-
-                # Ejecutar el SP para crear el reporte
-                sp_call = """
-                EXEC sp_ecosystem_create_columns_config
-                    ?, -- @report_prefix
-                    ?, -- @report_description
-                    ?, -- @report_description_es
-                    'report', -- @type
-                    1, -- @table_number
-                    ?, -- @query
-                    ?, -- @params_config
-                    ?, -- @is_detail
-                    ?, -- @hasDetail
-                    ?, -- @actionColumn
-                    ?, -- @detail_prefix
-                    ?, -- @detail_mode
-                    ?, -- @open_another_tab
-                    ?, -- @type_resource
-                    ?, -- @columns_to_render
-                    ?  -- default_for_all
-                """
-
-                cursor.execute(
-                    sp_call,
-                    (
-                        report_data["report_prefix"],
-                        report_data["report_description_en"],
-                        report_data["report_description_es"],
-                        report_data["query"],
-                        params_json,
-                        report_data.get("is_detail", 0),
-                        report_data.get("has_detail"),
-                        report_data.get("action_column"),
-                        report_data.get("detail_prefix"),
-                        report_data.get("detail_mode"),
-                        report_data.get("open_another_tab"),
-                        report_data.get("type_resource", "table"),
-                        report_data.get("columns_to_render"),
-                        report_data.get("default_for_all", 0),
-                    ),
-                )
+        failed_reports = []
 
-                successful_reports.append(
-                    {
-                        "index": i,
-                        "report_prefix": report_data["report_prefix"],
-                        "query_database": DB_CONFIGS[query_database_key]["database"],
-                        "sp_database": DB_CONFIGS["default"]["database"],
-                    }
-                )
-                total_created += 1
+        # Paso 1 y 2: Validar los reportes y ejecutar el SP por bloques de _SP_BATCH_SIZE filas
+        valid_rows = _iter_valid_rows(reports_data, failed_reports)
+        chunk = list(itertools.islice(valid_rows, _SP_BATCH_SIZE))
+        if chunk:
+            with borrow_conn("default") as conn:
+                cursor = conn.cursor()
 
-            except Exception as e:
-                failed_reports.append(
-                    {
-                        "index": i,
-                        "report_prefix": report_data.get("report_prefix", "N/A"),
-                        "error": str(e),
-                    }
-                )
+                while chunk:
+                    try:
+                        # fast_executemany envía las filas del bloque como un arreglo de parámetros en un solo RPC
+                        cursor.fast_executemany = True
+                        cursor.executemany(
+                            _SP_CREATE_COLUMNS_CONFIG, [params for _, params in chunk]
+                        )
+                        successful_reports.extend(
+                            report_info for report_info, _ in chunk
+                        )
 
-        conn.commit()
-        conn.close()
+                    except pyodbc.Error:
+                        # Si el bloque falla, deshacerlo y reintentar solo sus filas una por una
+                        conn.rollback()
+                        cursor.fast_executemany = False
+                        for report_info, params in chunk:
+                            try:
+                                cursor.execute(_SP_CREATE_COLUMNS_CONFIG, params)
+                                successful_reports.append(report_info)
+                            except Exception as e:
+                                failed_reports.append(
+                                    {
+                                        "index": report_info["index"],
+                                        "report_prefix": report_info["report_prefix"],
+                                        "error": str(e),
+                                    }
+                                )
+
+                    # Confirmar cada bloque para que un fallo posterior no deshaga los anteriores
+                    conn.commit()
+                    chunk = list(itertools.islice(valid_rows, _SP_BATCH_SIZE))
+
+                cursor.close()
+
+        failed_reports.sort(key=lambda report: report["index"])
+        total_created = len(successful_reports)
 
         # Construir resultado
-        result = "📊 Creación masiva de reportes completada!\n\n"
-        result += f"✅ Reportes creados exitosamente: {total_created}\n"
-        result += f"❌ Reportes fallidos: {len(failed_reports)}\n\n"
+        parts = ["📊 Creación masiva de reportes completada!\n\n"]
+        parts.append(f"✅ Reportes creados exitosamente: {total_created}\n")
+        parts.append(f"❌ Reportes fallidos: {len(failed_reports)}\n\n")
 
         if successful_reports:
-            result += "📋 Reportes creados:\n"
+            parts.append("📋 Reportes creados:\n")
             for report in successful_reports:
-                result += f"  {report['index']}. {report['report_prefix']}\n"
-                result += f"     Query apunta a: {report['query_database']}\n"
-                result += f"     SP ejecutado en: {report['sp_database']}\n\n"
+                parts.append(f"  {report['index']}. {report['report_prefix']}\n")
+                parts.append(f"     Query apunta a: {report['query_database']}\n")
+                parts.append(f"     SP ejecutado en: {report['sp_database']}\n\n")
 
         if failed_reports:
-            result += "❌ Reportes fallidos:\n"
+            parts.append("❌ Reportes fallidos:\n")
             for report in failed_reports:
-                result += f"  {report['index']}. {report['report_prefix']}: {report['error']}\n"
+                parts.append(
+                    f"  {report['index']}. {report['report_prefix']}: {report['error']}\n"
+                )
 
-        return result
+        return "".join(parts)
 
     except Exception as e:
         return f"❌ Error en creación masiva: {str(e)}"
 
 
+def _assignment_key(business_unit, report_prefix, role_code) -> tuple:
+    """Clave de una asignación sin distinguir mayúsculas, como las comparaciones de SQL Server"""
+    return (
+        str(business_unit).lower(),
+        str(report_prefix).lower(),
+        str(role_code).lower(),
+    )
+
+
+def _roles_cache_key(business_unit: str) -> str:
+    """Normaliza la unidad de negocio igual que la compara SQL Server (sin mayúsculas ni espacios finales)"""
+    return business_unit.rstrip().casefold()
+
+
+def _load_roles(business_units) -> dict:
+    """
+    Obtiene los roles (excluyendo sys_admin) de varias unidades de negocio, consultando solo
+    las que no están en caché
+
+    Args:
+        business_units: Unidades de negocio a cargar
+
+    Returns:
+        Diccionario {unidad normalizada: [(code, description, application_type, order_), ...]}
+        ordenado por [order_] y [description]. Las unidades sin roles quedan con una lista vacía.
+    """
+    roles_by_unit = {}
+    misses = []
+    now = time.monotonic()
+    for business_unit in business_units:
+        key = _roles_cache_key(business_unit)
+        entry = _ROLES_CACHE.get(key)
+        if entry is None or now - entry[0] > ROLES_CACHE_TTL_S:
+            misses.append(business_unit)
+        else:
+            roles_by_unit[key] = entry[1]
+
+    if misses:
+        fetched = {_roles_cache_key(business_unit): [] for business_unit in misses}
+        with borrow_conn("default") as conn:
+            cursor = conn.cursor()
+
+            for start in range(0, len(misses), _MAX_UNITS_PER_QUERY):
+                chunk = misses[start : start + _MAX_UNITS_PER_QUERY]
+                padded = _pad_in_list(chunk)
+                cursor.execute(_q_roles(len(padded)), padded)
+                for business_unit, *role in cursor.fetchall():
+                    fetched.setdefault(_roles_cache_key(business_unit), []).append(
+                        tuple(role)
+                    )
+            cursor.close()
+
+        with _ROLES_CACHE_LOCK:
+            for key, roles in fetched.items():
+                _cache_put(
+                    _ROLES_CACHE, key, roles, ROLES_CACHE_TTL_S, ROLES_CACHE_MAX_ENTRIES
+                )
+        roles_by_unit.update(fetched)
+
+    return roles_by_unit
+
+
+def _fetch_roles_by_description(pairs: set) -> dict:
+    """
+    Busca los roles de varias combinaciones (business_unit, role_description) a la vez
+
+    Los roles de cada unidad salen de la caché de default_roles y la coincidencia parcial de
+    la descripción se resuelve aquí, sin distinguir mayúsculas ni espacios laterales. Por
+    combinación se guardan hasta dos roles (el primero es el que se usa y un segundo solo
+    activa la advertencia).
+
+    Args:
+        pairs: Conjunto de tuplas (business_unit, role_description)
+
+    Returns:
+        Diccionario {(business_unit, role_description): [(code, description, application_type), ...]}
+    """
+    roles_by_unit = _load_roles({business_unit for business_unit, _ in pairs})
+
+    # Descripciones normalizadas una sola vez por unidad, no una vez por combinación
+    normalized_by_unit = {
+        key: [
+            ((description or "").strip().casefold(), (code, description, app_type))
+            for code, description, app_type, _ in roles
+        ]
+        for key, roles in roles_by_unit.items()
+    }
+
+    roles_by_description = {}
+    for business_unit, role_description in pairs:
+        pattern = role_description.strip().casefold()
+        matches = roles_by_description[(business_unit, role_description)] = []
+        for normalized, role in normalized_by_unit[_roles_cache_key(business_unit)]:
+            if pattern in normalized:
+                matches.append(role)
+                if len(matches) == 2:
+                    break
+
+    return roles_by_description
+
+
+def _merge_assignments(cursor, rows: list) -> set:
+    """
+    Inserta las asignaciones que no existen todavía con un solo MERGE
+
+    Args:
+        cursor: Cursor de la base de datos por defecto
+        rows: Parámetros de cada asignación, en el orden de las columnas de _Q_MERGE_ASSIGNMENTS
+
+    Returns:
+        Conjunto con las posiciones (dentro de rows) de las asignaciones insertadas
+    """
+    rows_json = json.dumps(
+        [[position, *row] for position, row in enumerate(rows)], default=str
+    )
+    cursor.execute(_Q_MERGE_ASSIGNMENTS, rows_json)
+    return {position for (position,) in cursor.fetchall()}
+
+
+def _validate_assignment(assignment_data: dict) -> str | None:
+    """
+    Valida los campos requeridos, su tipo y el tipo de aplicación de una asignación del lote
+
+    Returns:
+        Mensaje de error, o None si la asignación es válida
+    """
+    missing_fields = [
+        field for field in _ASSIGNMENT_REQUIRED_FIELDS if field not in assignment_data
+    ]
+    if missing_fields:
+        return f"Campos faltantes: {', '.join(missing_fields)}"
+
+    # Un valor que no es texto (número, lista...) haría fallar la búsqueda de roles de todo el lote
+    for field in _ASSIGNMENT_TEXT_FIELDS:
+        value = assignment_data[field]
+        if not isinstance(value, str):
+            return f"{field} debe ser texto, recibido: {type(value).__name__}"
+
+    app_type = assignment_data["application_type"]
+    if app_type not in _VALID_APP_TYPES:
+        return f"application_type debe ser 'sales_force' o 'merchandising', recibido: '{app_type}'"
+
+    return None
+
+
 @mcp.tool()
 def bulk_assign_reports_to_roles(assignments_data: list) -> str:
     """
@@ -958,131 +1930,105 @@ def bulk_assign_reports_to_roles(assignments_data: list) -> str:
         if not assignments_data:
             return "⚠️ No se proporcionaron datos de asignaciones"
 
-        conn = get_db_connection("default")
-        cursor = conn.cursor()
-
         successful_assignments = []
         failed_assignments = []
         skipped_assignments = []
-        total_inserted = 0
 
-        # Validar tipos de aplicación permitidos
-        valid_app_types = ["sales_force", "merchandising"]
+        # Asignaciones válidas pendientes de insertar: (info de la asignación, parámetros del INSERT)
+        pending_assignments = []
+        pending_keys = set()
 
+        # Paso 1: Validar campos y tipo de aplicación de cada asignación (sin tocar la base de datos)
+        candidates = []
         for i, assignment_data in enumerate(assignments_data, 1):
             try:
-                # Validar campos requeridos
-                required_fields = [
-                    "report_prefix",
-                    "business_unit",
-                    "role_description",
-                    "application_type",
-                ]
-                missing_fields = [
-                    field for field in required_fields if field not in assignment_data
-                ]
-
-                if missing_fields:
-                    failed_assignments.append(
-                        {
-                            "index": i,
-                            "report_prefix": assignment_data.get(
-                                "report_prefix", "N/A"
-                            ),
-                            "business_unit": assignment_data.get(
-                                "business_unit", "N/A"
-                            ),
-                            "error": f"Campos faltantes: {', '.join(missing_fields)}",
-                        }
-                    )
-                    continue
-
-                # Validar tipo de aplicación
-                app_type = assignment_data["application_type"]
-                if app_type not in valid_app_types:
-                    failed_assignments.append(
-                        {
-                            "index": i,
-                            "report_prefix": assignment_data["report_prefix"],
-                            "business_unit": assignment_data["business_unit"],
-                            "error": f"application_type debe ser 'sales_force' o 'merchandising', recibido: '{app_type}'",
-                        }
-                    )
-                    continue
+                error = _validate_assignment(assignment_data)
+            except Exception as e:
+                error = str(e)
 
-                # Buscar el código del rol por descripción
-                role_query = """
-                SELECT [code], [description], [application_type]
-                FROM default_roles 
-                WHERE business_unit = ? AND [description] LIKE ? AND application_type != 'sys_admin'
-                """
+            if error:
+                failed_assignments.append(
+                    {
+                        "index": i,
+                        "report_prefix": assignment_data.get("report_prefix", "N/A"),
+                        "business_unit": assignment_data.get("business_unit", "N/A"),
+                        "error": error,
+                    }
+                )
+            else:
+                candidates.append((i, assignment_data))
+
+        # Paso 2: Buscar los roles de todas las asignaciones (caché de default_roles)
+        roles_by_description = _fetch_roles_by_description(
+            {
+                (data["business_unit"], data["role_description"])
+                for _, data in candidates
+            },
+        )
 
-                cursor.execute(
-                    role_query,
-                    (
-                        assignment_data["business_unit"],
-                        f"%{assignment_data['role_description']}%",
-                    ),
+        resolved = []
+        for i, assignment_data in candidates:
+            roles = roles_by_description[
+                (
+                    assignment_data["business_unit"],
+                    assignment_data["role_description"],
                 )
-                roles = cursor.fetchall()
-
-                if not roles:
-                    failed_assignments.append(
-                        {
-                            "index": i,
-                            "report_prefix": assignment_data["report_prefix"],
-                            "business_unit": assignment_data["business_unit"],
-                            "error": f"No se encontró rol con descripción '{assignment_data['role_description']}' (excluyendo sys_admin)",
-                        }
-                    )
-                    continue
+            ]
 
-                # Usar el primer rol encontrado
-                role_code, role_desc, role_app_type = roles[0]
+            if not roles:
+                failed_assignments.append(
+                    {
+                        "index": i,
+                        "report_prefix": assignment_data["report_prefix"],
+                        "business_unit": assignment_data["business_unit"],
+                        "error": f"No se encontró rol con descripción '{assignment_data['role_description']}' (excluyendo sys_admin)",
+                    }
+                )
+                continue
 
-                if len(roles) > 1:
-                    warning_msg = f"Se encontraron múltiples roles. Usando: {role_code} - {role_desc}"
-                else:
-                    warning_msg = ""
+            resolved.append((i, assignment_data, roles))
 
-                # Verificar si ya existe la asignación
-                check_query = """
-                SELECT COUNT(*) FROM assigned_reports 
-                WHERE business_unit = ? AND report_prefix = ? AND [role] = ?
-                """
+        # Paso 3: Descartar los duplicados dentro del lote y preparar las filas a insertar
+        for i, assignment_data, roles in resolved:
+            # Usar el primer rol encontrado
+            role_code, role_desc, role_app_type = roles[0]
 
-                cursor.execute(
-                    check_query,
-                    (
-                        assignment_data["business_unit"],
-                        assignment_data["report_prefix"],
-                        role_code,
-                    ),
+            if len(roles) > 1:
+                warning_msg = (
+                    f"Se encontraron múltiples roles. Usando: {role_code} - {role_desc}"
                 )
-                exists = cursor.fetchone()[0]
-
-                if exists > 0:
-                    skipped_assignments.append(
-                        {
-                            "index": i,
-                            "report_prefix": assignment_data["report_prefix"],
-                            "business_unit": assignment_data["business_unit"],
-                            "role_code": role_code,
-                            "reason": "Asignación ya existe",
-                        }
-                    )
-                    continue
-
-                # Insertar la nueva asignación
-                insert_query = """
-                INSERT INTO assigned_reports (
-                    [role], report_prefix, business_unit, application_type, [order], 
-                    custom_tag, sales_office, center_logistical
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """
+            else:
+                warning_msg = ""
 
-                cursor.execute(
-                    insert_query,
+            assignment_key = _assignment_key(
+                assignment_data["business_unit"],
+                assignment_data["report_prefix"],
+                role_code,
+            )
+            if assignment_key in pending_keys:
+                skipped_assignments.append(
+                    {
+                        "index": i,
+                        "report_prefix": assignment_data["report_prefix"],
+                        "business_unit": assignment_data["business_unit"],
+                        "role_code": role_code,
+                        "reason": "Asignación ya existe",
+                    }
+                )
+                continue
+
+            pending_keys.add(assignment_key)
+            pending_assignments.append(
+                (
+                    {
+                        "index": i,
+                        "report_prefix": assignment_data["report_prefix"],
+                        "business_unit": assignment_data["business_unit"],
+                        "role_code": role_code,
+                        "role_description": role_desc,
+                        "application_type": assignment_data["application_type"],
+                        "warning": warning_msg,
+                    },
                     (
                         role_code,
                         assignment_data["report_prefix"],
@@ -1094,59 +2040,99 @@ def bulk_assign_reports_to_roles(assignments_data: list) -> str:
                         assignment_data.get("center_logistical"),
                     ),
                 )
+            )
 
-                successful_assignments.append(
-                    {
-                        "index": i,
-                        "report_prefix": assignment_data["report_prefix"],
-                        "business_unit": assignment_data["business_unit"],
-                        "role_code": role_code,
-                        "role_description": role_desc,
-                        "application_type": assignment_data["application_type"],
-                        "warning": warning_msg,
-                    }
-                )
-                total_inserted += 1
+        # La conexión solo se toma para la escritura, no durante la validación ni la resolución de roles
+        if pending_assignments:
+            with borrow_conn("default") as conn:
+                cursor = conn.cursor()
 
-            except Exception as e:
-                failed_assignments.append(
-                    {
-                        "index": i,
-                        "report_prefix": assignment_data.get("report_prefix", "N/A"),
-                        "business_unit": assignment_data.get("business_unit", "N/A"),
-                        "error": str(e),
-                    }
-                )
+                # Paso 4: Insertar con MERGE solo las asignaciones que todavía no existen;
+                # OUTPUT indica cuáles se insertaron y el resto ya estaba asignado
+                failed_positions = set()
+                try:
+                    inserted_positions = _merge_assignments(
+                        cursor, [params for _, params in pending_assignments]
+                    )
+
+                except pyodbc.Error:
+                    # Si un bloque falla, deshacer todo y reintentar fila por fila para aislar las asignaciones con error
+                    conn.rollback()
+                    inserted_positions = set()
+                    for position, (assignment, params) in enumerate(
+                        pending_assignments
+                    ):
+                        try:
+                            if _merge_assignments(cursor, [params]):
+                                inserted_positions.add(position)
+                        except Exception as e:
+                            failed_positions.add(position)
+                            failed_assignments.append(
+                                {
+                                    "index": assignment["index"],
+                                    "report_prefix": assignment["report_prefix"],
+                                    "business_unit": assignment["business_unit"],
+                                    "error": str(e),
+                                }
+                            )
+
+                for position, (assignment, _) in enumerate(pending_assignments):
+                    if position in inserted_positions:
+                        successful_assignments.append(assignment)
+                    elif position not in failed_positions:
+                        skipped_assignments.append(
+                            {
+                                "index": assignment["index"],
+                                "report_prefix": assignment["report_prefix"],
+                                "business_unit": assignment["business_unit"],
+                                "role_code": assignment["role_code"],
+                                "reason": "Asignación ya existe",
+                            }
+                        )
+
+                conn.commit()
+                cursor.close()
 
-        conn.commit()
-        conn.close()
+        skipped_assignments.sort(key=lambda assignment: assignment["index"])
+        failed_assignments.sort(key=lambda assignment: assignment["index"])
+        total_inserted = len(successful_assignments)
 
         # Construir resultado
-        result = "📊 Asignación masiva de reportes completada!\n\n"
-        result += f"✅ Asignaciones creadas: {total_inserted}\n"
-        result += f"⏭️ Asignaciones omitidas (ya existían): {len(skipped_assignments)}\n"
-        result += f"❌ Asignaciones fallidas: {len(failed_assignments)}\n\n"
+        parts = ["📊 Asignación masiva de reportes completada!\n\n"]
+        parts.append(f"✅ Asignaciones creadas: {total_inserted}\n")
+        parts.append(
+            f"⏭️ Asignaciones omitidas (ya existían): {len(skipped_assignments)}\n"
+        )
+        parts.append(f"❌ Asignaciones fallidas: {len(failed_assignments)}\n\n")
 
         if successful_assignments:
-            result += "📋 Asignaciones creadas:\n"
+            parts.append("📋 Asignaciones creadas:\n")
             for assignment in successful_assignments:
-                result += f"  {assignment['index']}. {assignment['report_prefix']} → {assignment['role_code']} - {assignment['role_description']}\n"
-                result += f"     Unidad: {assignment['business_unit']} | Tipo: {assignment['application_type']}\n"
+                parts.append(
+                    f"  {assignment['index']}. {assignment['report_prefix']} → {assignment['role_code']} - {assignment['role_description']}\n"
+                )
+                parts.append(
+                    f"     Unidad: {assignment['business_unit']} | Tipo: {assignment['application_type']}\n"
+                )
                 if assignment["warning"]:
-                    result += f"     ⚠️ {assignment['warning']}\n"
-                result += "\n"
+                    parts.append(f"     ⚠️ {assignment['warning']}\n")
+                parts.append("\n")
 
         if skipped_assignments:
-            result += "⏭️ Asignaciones omitidas:\n"
+            parts.append("⏭️ Asignaciones omitidas:\n")
             for assignment in skipped_assignments:
-                result += f"  {assignment['index']}. {assignment['report_prefix']} → {assignment['role_code']} ({assignment['reason']})\n"
+                parts.append(
+                    f"  {assignment['index']}. {assignment['report_prefix']} → {assignment['role_code']} ({assignment['reason']})\n"
+                )
 
         if failed_assignments:
-            result += "\n❌ Asignaciones fallidas:\n"
+            parts.append("\n❌ Asignaciones fallidas:\n")
             for assignment in failed_assignments:
-                result += f"  {assignment['index']}. {assignment['report_prefix']} ({assignment['business_unit']}): {assignment['error']}\n"
+                parts.append(
+                    f"  {assignment['index']}. {assignment['report_prefix']} ({assignment['business_unit']}): {assignment['error']}\n"
+                )
 
-        return result
+        return "".join(parts)
 
     except Exception as e:
         return f"❌ Error en asignación masiva: {str(e)}"
@@ -1170,110 +2156,86 @@ def bulk_get_report_assignments(
         if not report_prefixes:
             return "⚠️ No se proporcionaron prefijos de reportes"
 
-        conn = get_db_connection("default")
-        cursor = conn.cursor()
-
-        # Crear placeholders para la consulta IN
-        placeholders = ",".join(["?" for _ in report_prefixes])
-
-        if business_unit:
-            query = f"""
-            SELECT ar.[role], ar.report_prefix, ar.business_unit, ar.application_type, 
-                   ar.[order], ar.custom_tag, ar.sales_office, ar.center_logistical,
-                   dr.[description] as role_description
-            FROM assigned_reports ar
-            LEFT JOIN default_roles dr ON ar.[role] = dr.[code] AND ar.business_unit = dr.business_unit
-            WHERE ar.report_prefix IN ({placeholders}) AND ar.business_unit = ?
-            ORDER BY ar.report_prefix, ar.[order], dr.[description]
-            """
-            cursor.execute(query, report_prefixes + [business_unit])
-        else:
-            query = f"""
-            SELECT ar.[role], ar.report_prefix, ar.business_unit, ar.application_type, 
-                   ar.[order], ar.custom_tag, ar.sales_office, ar.center_logistical,
-                   dr.[description] as role_description
-            FROM assigned_reports ar
-            LEFT JOIN default_roles dr ON ar.[role] = dr.[code] AND ar.business_unit = dr.business_unit
-            WHERE ar.report_prefix IN ({placeholders})
-            ORDER BY ar.business_unit, ar.report_prefix, ar.[order], dr.[description]
-            """
-            cursor.execute(query, report_prefixes)
-
-        assignments = cursor.fetchall()
-
-        if not assignments:
-            reports_str = ", ".join(report_prefixes)
-            scope = (
-                f"para la unidad {business_unit}"
-                if business_unit
-                else "en ninguna unidad"
-            )
-            return f"❌ No se encontraron asignaciones para los reportes '{reports_str}' {scope}"
-
-        # Agrupar resultados por reporte
-        reports_data = {}
-        for assignment in assignments:
-            (
-                role,
-                prefix,
-                bu,
-                app_type,
-                order,
-                tag,
-                sales_office,
-                center_log,
-                role_desc,
-            ) = assignment
+        with borrow_conn("default") as conn:
+            cursor = conn.cursor()
+            cursor.arraysize = _FETCH_ARRAYSIZE
+
+            # Cada prefijo viaja con su posición en la lista, así las filas llegan ya
+            # agrupadas por reporte y en el orden solicitado, con el total de cada grupo
+            params = [json.dumps(list(enumerate(report_prefixes)), default=str)]
+            if business_unit:
+                params.append(business_unit)
+
+            cursor.execute(_q_report_assignments(bool(business_unit)), params)
+
+            # Leer las filas por bloques en lugar de materializar todo el resultado
+            chunks = iter(cursor.fetchmany, [])
+            first_chunk = next(chunks, [])
+
+            if not first_chunk:
+                cursor.close()
+                reports_str = ", ".join(report_prefixes)
+                scope = (
+                    f"para la unidad {business_unit}"
+                    if business_unit
+                    else "en ninguna unidad"
+                )
+                return f"❌ No se encontraron asignaciones para los reportes '{reports_str}' {scope}"
+
+            # Construir resultado
+            parts = [
+                "📋 Asignaciones de reportes solicitados:\n",
+                f"📊 Reportes consultados: {', '.join(report_prefixes)}\n",
+            ]
+            if business_unit:
+                parts.append(f"🏢 Unidad: {business_unit}\n")
+            parts.append("\n")
+
+            total_assignments = 0
+            next_pos = 0
+            for chunk in itertools.chain([first_chunk], chunks):
+                for (
+                    pos,
+                    role,
+                    bu,
+                    app_type,
+                    order,
+                    tag,
+                    sales_office,
+                    center_log,
+                    role_desc,
+                    assignment_count,
+                ) in chunk:
+                    # Primera fila de un reporte: cerrar los reportes intermedios sin filas
+                    if pos >= next_pos:
+                        for missing_prefix in report_prefixes[next_pos:pos]:
+                            parts.append(
+                                f"❌ Reporte '{missing_prefix}': Sin asignaciones\n\n"
+                            )
+                        parts.append(f"📄 Reporte: {report_prefixes[pos]}\n")
+                        parts.append(f"  📊 Total asignaciones: {assignment_count}\n")
+                        total_assignments += assignment_count
+                        next_pos = pos + 1
+
+                    parts.append(
+                        f"    • Rol: {role} - {role_desc or 'N/A'}\n"
+                        f"      Unidad: {bu}\n"
+                        f"      Tipo: {app_type or 'N/A'}\n"
+                        f"      Orden: {order or 'N/A'}\n"
+                        f"      Etiqueta: {tag or 'N/A'}\n"
+                        f"      Oficina: {sales_office or 'N/A'}\n"
+                        f"      Centro: {center_log or 'N/A'}\n\n"
+                    )
 
-            if prefix not in reports_data:
-                reports_data[prefix] = []
+            for missing_prefix in report_prefixes[next_pos:]:
+                parts.append(f"❌ Reporte '{missing_prefix}': Sin asignaciones\n\n")
 
-            reports_data[prefix].append(
-                {
-                    "role": role,
-                    "business_unit": bu,
-                    "application_type": app_type,
-                    "order": order,
-                    "custom_tag": tag,
-                    "sales_office": sales_office,
-                    "center_logistical": center_log,
-                    "role_description": role_desc,
-                }
+            parts.append(
+                f"📈 Resumen: {total_assignments} asignaciones encontradas en total"
             )
 
-        # Construir resultado
-        result = "📋 Asignaciones de reportes solicitados:\n"
-        result += f"📊 Reportes consultados: {', '.join(report_prefixes)}\n"
-        if business_unit:
-            result += f"🏢 Unidad: {business_unit}\n"
-        result += "\n"
-
-        total_assignments = 0
-        for report_prefix in report_prefixes:
-            if report_prefix in reports_data:
-                assignments_list = reports_data[report_prefix]
-                total_assignments += len(assignments_list)
-
-                result += f"📄 Reporte: {report_prefix}\n"
-                result += f"  📊 Total asignaciones: {len(assignments_list)}\n"
-
-                for assignment in assignments_list:
-                    result += f"    • Rol: {assignment['role']} - {assignment['role_description'] or 'N/A'}\n"
-                    result += f"      Unidad: {assignment['business_unit']}\n"
-                    result += f"      Tipo: {assignment['application_type'] or 'N/A'}\n"
-                    result += f"      Orden: {assignment['order'] or 'N/A'}\n"
-                    result += f"      Etiqueta: {assignment['custom_tag'] or 'N/A'}\n"
-                    result += f"      Oficina: {assignment['sales_office'] or 'N/A'}\n"
-                    result += (
-                        f"      Centro: {assignment['center_logistical'] or 'N/A'}\n\n"
-                    )
-            else:
-                result += f"❌ Reporte '{report_prefix}': Sin asignaciones\n\n"
-
-        result += f"📈 Resumen: {total_assignments} asignaciones encontradas en total"
-
-        conn.close()
-        return result
+            cursor.close()
+        return "".join(parts)
 
     except Exception as e:
         return f"❌ Error al obtener asignaciones masivas: {str(e)}"
@@ -1310,79 +2272,35 @@ def bulk_update_report_assignments(
         if not role_codes:
             return "⚠️ No se proporcionaron códigos de roles para actualizar"
 
-        conn = get_db_connection("default")
-        cursor = conn.cursor()
-
-        # Paso 1: Verificar cuántas asignaciones existen
-        placeholders = ",".join(["?" for _ in role_codes])
-        check_query = f"""
-        SELECT COUNT(*) FROM assigned_reports 
-        WHERE business_unit = ? AND report_prefix = ? AND [role] IN ({placeholders})
-        """
-
-        check_values = [business_unit, report_prefix] + role_codes
-        cursor.execute(check_query, check_values)
-        exists_count = cursor.fetchone()[0]
-
-        if exists_count == 0:
-            return f"❌ No existen asignaciones del reporte '{report_prefix}' para los roles {', '.join(role_codes)} en la unidad {business_unit}"
-
-        # Paso 2: Obtener información de los roles que se van a actualizar
-        roles_query = f"""
-        SELECT ar.[role], dr.[description] as role_description
-        FROM assigned_reports ar
-        LEFT JOIN default_roles dr ON ar.[role] = dr.[code] AND ar.business_unit = dr.business_unit
-        WHERE ar.business_unit = ? AND ar.report_prefix = ? AND ar.[role] IN ({placeholders})
-        ORDER BY ar.[role]
-        """
-
-        cursor.execute(roles_query, check_values)
-        roles_info = cursor.fetchall()
-
-        # Paso 3: Construir la query de actualización
-        update_fields = []
-        update_values = []
-
-        if application_type is not None:
-            update_fields.append("application_type = ?")
-            update_values.append(application_type)
-
-        if order is not None:
-            update_fields.append("[order] = ?")
-            update_values.append(order)
-
-        if custom_tag is not None:
-            update_fields.append("custom_tag = ?")
-            update_values.append(custom_tag)
-
-        if sales_office is not None:
-            update_fields.append("sales_office = ?")
-            update_values.append(sales_office)
-
-        if center_logistical is not None:
-            update_fields.append("center_logistical = ?")
-            update_values.append(center_logistical)
-
-        if not update_fields:
+        mask, update_values = _assignment_updates(
+            application_type, order, custom_tag, sales_office, center_logistical
+        )
+        if not mask:
             return "⚠️ No se proporcionaron campos para actualizar"
 
         # Agregar los valores de WHERE
-        update_values.extend([business_unit, report_prefix] + role_codes)
+        update_values.extend([business_unit, report_prefix, *role_codes])
+
+        with borrow_conn("default") as conn:
+            cursor = conn.cursor()
+
+            # Actualizar y devolver en la misma sentencia los roles afectados con su descripción
+            cursor.execute(
+                _q_update_assignments(mask, len(role_codes), _OUTPUT_UPDATED_ROLES),
+                update_values,
+            )
+            roles_info = sorted(cursor.fetchall(), key=lambda role: role[0])
 
-        update_query = f"""
-        UPDATE assigned_reports 
-        SET {", ".join(update_fields)}
-        WHERE business_unit = ? AND report_prefix = ? AND [role] IN ({placeholders})
-        """
+            if not roles_info:
+                return f"❌ No existen asignaciones del reporte '{report_prefix}' para los roles {', '.join(role_codes)} en la unidad {business_unit}"
 
-        cursor.execute(update_query, update_values)
-        affected_rows = cursor.rowcount
-        conn.commit()
-        conn.close()
+            affected_rows = len(roles_info)
+            conn.commit()
+            cursor.close()
 
         # Construir mensaje de resultado
         roles_text = "\n  • ".join(
-            [f"{role[0]} - {role[1] or 'N/A'}" for role in roles_info]
+            f"{role[0]} - {role[1] or 'N/A'}" for role in roles_info
         )
 
         changes_text = []
@@ -1447,84 +2365,39 @@ def update_report_assignment(
         Resultado de la actualización
     """
     try:
-        conn = get_db_connection("default")
-        cursor = conn.cursor()
-
-        # Paso 1: Verificar si existe la asignación
-        check_query = """
-        SELECT COUNT(*) FROM assigned_reports 
-        WHERE business_unit = ? AND report_prefix = ? AND [role] = ?
-        """
-
-        cursor.execute(check_query, (business_unit, report_prefix, role_code))
-        exists = cursor.fetchone()[0]
-
-        if exists == 0:
-            return f"❌ No existe una asignación del reporte '{report_prefix}' para el rol '{role_code}' en la unidad {business_unit}"
-
-        # Paso 2: Obtener la asignación actual para mostrar qué se va a cambiar
-        current_query = """
-        SELECT ar.application_type, ar.[order], ar.custom_tag, ar.sales_office, ar.center_logistical,
-               dr.[description] as role_description
-        FROM assigned_reports ar
-        LEFT JOIN default_roles dr ON ar.[role] = dr.[code] AND ar.business_unit = dr.business_unit
-        WHERE ar.business_unit = ? AND ar.report_prefix = ? AND ar.[role] = ?
-        """
-
-        cursor.execute(current_query, (business_unit, report_prefix, role_code))
-        current = cursor.fetchone()
-
-        if not current:
-            return "❌ Error al obtener la asignación actual"
-
-        (
-            current_app_type,
-            current_order,
-            current_tag,
-            current_sales_office,
-            current_center_log,
-            role_desc,
-        ) = current
-
-        # Paso 3: Construir la query de actualización solo con los campos proporcionados
-        update_fields = []
-        update_values = []
-
-        if application_type is not None:
-            update_fields.append("application_type = ?")
-            update_values.append(application_type)
-
-        if order is not None:
-            update_fields.append("[order] = ?")
-            update_values.append(order)
-
-        if custom_tag is not None:
-            update_fields.append("custom_tag = ?")
-            update_values.append(custom_tag)
-
-        if sales_office is not None:
-            update_fields.append("sales_office = ?")
-            update_values.append(sales_office)
-
-        if center_logistical is not None:
-            update_fields.append("center_logistical = ?")
-            update_values.append(center_logistical)
-
-        if not update_fields:
+        mask, update_values = _assignment_updates(
+            application_type, order, custom_tag, sales_office, center_logistical
+        )
+        if not mask:
             return "⚠️ No se proporcionaron campos para actualizar"
 
         # Agregar los valores de WHERE
         update_values.extend([business_unit, report_prefix, role_code])
 
-        update_query = f"""
-        UPDATE assigned_reports 
-        SET {", ".join(update_fields)}
-        WHERE business_unit = ? AND report_prefix = ? AND [role] = ?
-        """
+        with borrow_conn("default") as conn:
+            cursor = conn.cursor()
+
+            # Actualizar y devolver en la misma sentencia los valores anteriores (deleted)
+            # y la descripción del rol; si no hay fila, la asignación no existe
+            cursor.execute(
+                _q_update_assignments(mask, 1, _OUTPUT_PREVIOUS_VALUES), update_values
+            )
+            current = cursor.fetchone()
+
+            if not current:
+                return f"❌ No existe una asignación del reporte '{report_prefix}' para el rol '{role_code}' en la unidad {business_unit}"
 
-        cursor.execute(update_query, update_values)
-        conn.commit()
-        conn.close()
+            (
+                current_app_type,
+                current_order,
+                current_tag,
+                current_sales_office,
+                current_center_log,
+                role_desc,
+            ) = current
+
+            conn.commit()
+            cursor.close()
 
         # Construir mensaje de cambios
         changes = []
@@ -1574,31 +2447,19 @@ def list_available_roles(business_unit: str) -> str:
         Lista de roles disponibles con sus códigos y descripciones
     """
     try:
-        conn = get_db_connection("default")
-        cursor = conn.cursor()
-
-        query = """
-        SELECT [code], [description], [application_type], [order_]
-        FROM default_roles 
-        WHERE business_unit = ? AND application_type != 'sys_admin'
-        ORDER BY [order_], [description]
-        """
-
-        cursor.execute(query, business_unit)
-        roles = cursor.fetchall()
+        roles = _load_roles([business_unit])[_roles_cache_key(business_unit)]
 
         if not roles:
             return f"❌ No se encontraron roles para la unidad {business_unit} (excluyendo sys_admin)"
 
-        result = f"👥 Roles disponibles para la unidad {business_unit}:\n\n"
+        parts = [f"👥 Roles disponibles para la unidad {business_unit}:\n\n"]
         for role in roles:
             code, description, app_type, order = role
-            result += (
+            parts.append(
                 f"  • {code} - {description} ({app_type}) [Orden: {order or 'N/A'}]\n"
             )
 
-        conn.close()
-        return result
+        return "".join(parts)
 
     except Exception as e:
         return f"❌ Error al listar roles: {str(e)}"
@@ -1617,33 +2478,34 @@ def get_report_assignments(report_prefix: str, business_unit: str = None) -> str
         Lista de asignaciones del reporte
     """
     try:
-        conn = get_db_connection("default")
-        cursor = conn.cursor()
-
-        if business_unit:
-            query = """
-            SELECT ar.[role], ar.report_prefix, ar.business_unit, ar.application_type, 
-                   ar.[order], ar.custom_tag, ar.sales_office, ar.center_logistical,
-                   dr.[description] as role_description
-            FROM assigned_reports ar
-            LEFT JOIN default_roles dr ON ar.[role] = dr.[code] AND ar.business_unit = dr.business_unit
-            WHERE ar.report_prefix = ? AND ar.business_unit = ?
-            ORDER BY ar.[order], dr.[description]
-            """
-            cursor.execute(query, (report_prefix, business_unit))
-        else:
-            query = """
-            SELECT ar.[role], ar.report_prefix, ar.business_unit, ar.application_type, 
-                   ar.[order], ar.custom_tag, ar.sales_office, ar.center_logistical,
-                   dr.[description] as role_description
-            FROM assigned_reports ar
-            LEFT JOIN default_roles dr ON ar.[role] = dr.[code] AND ar.business_unit = dr.business_unit
-            WHERE ar.report_prefix = ?
-            ORDER BY ar.business_unit, ar.[order], dr.[description]
-            """
-            cursor.execute(query, report_prefix)
-
-        assignments = cursor.fetchall()
+        with borrow_conn("default") as conn:
+            cursor = conn.cursor()
+
+            if business_unit:
+                query = """
+                SELECT ar.[role], ar.report_prefix, ar.business_unit, ar.application_type, 
+                       ar.[order], ar.custom_tag, ar.sales_office, ar.center_logistical,
+                       dr.[description] as role_description
+                FROM assigned_reports ar
+                LEFT JOIN default_roles dr ON ar.[role] = dr.[code] AND ar.business_unit = dr.business_unit
+                WHERE ar.report_prefix = ? AND ar.business_unit = ?
+                ORDER BY ar.[order], dr.[description]
+                """
+                cursor.execute(query, (report_prefix, business_unit))
+            else:
+                query = """
+                SELECT ar.[role], ar.report_prefix, ar.business_unit, ar.application_type, 
+                       ar.[order], ar.custom_tag, ar.sales_office, ar.center_logistical,
+                       dr.[description] as role_description
+                FROM assigned_reports ar
+                LEFT JOIN default_roles dr ON ar.[role] = dr.[code] AND ar.business_unit = dr.business_unit
+                WHERE ar.report_prefix = ?
+                ORDER BY ar.business_unit, ar.[order], dr.[description]
+                """
+                cursor.execute(query, report_prefix)
+
+            assignments = cursor.fetchall()
+            cursor.close()
 
         if not assignments:
             scope = (
@@ -1653,11 +2515,18 @@ def get_report_assignments(report_prefix: str, business_unit: str = None) -> str
             )
             return f"❌ No se encontraron asignaciones para el reporte '{report_prefix}' {scope}"
 
-        result = f"📋 Asignaciones del reporte '{report_prefix}':\n\n"
-        for assignment in assignments:
-            (
+        header = f"📋 Asignaciones del reporte '{report_prefix}':\n\n"
+        return header + "".join(
+            f"🏢 Unidad: {bu}\n"
+            f"  • Rol: {role} - {role_desc or 'N/A'}\n"
+            f"  • Tipo de aplicación: {app_type or 'N/A'}\n"
+            f"  • Orden: {order or 'N/A'}\n"
+            f"  • Etiqueta: {tag or 'N/A'}\n"
+            f"  • Oficina de ventas: {sales_office or 'N/A'}\n"
+            f"  • Centro logístico: {center_log or 'N/A'}\n\n"
+            for (
                 role,
-                prefix,
+                _,
                 bu,
                 app_type,
                 order,
@@ -1665,74 +2534,86 @@ def get_report_assignments(report_prefix: str, business_unit: str = None) -> str
                 sales_office,
                 center_log,
                 role_desc,
-            ) = assignment
-            result += f"🏢 Unidad: {bu}\n"
-            result += f"  • Rol: {role} - {role_desc or 'N/A'}\n"
-            result += f"  • Tipo de aplicación: {app_type or 'N/A'}\n"
-            result += f"  • Orden: {order or 'N/A'}\n"
-            result += f"  • Etiqueta: {tag or 'N/A'}\n"
-            result += f"  • Oficina de ventas: {sales_office or 'N/A'}\n"
-            result += f"  • Centro logístico: {center_log or 'N/A'}\n\n"
-
-        conn.close()
-        return result
+            ) in assignments
+        )
 
     except Exception as e:
         return f"❌ Error al obtener asignaciones: {str(e)}"
 
 
+def _search_table_in_db(db_key: str, table_name: str) -> str:
+    """
+    Busca una tabla en una base de datos para search_table_in_all_databases
+
+    Args:
+        db_key: Clave de la base de datos a consultar
+        table_name: Nombre de la tabla a buscar
+
+    Returns:
+        Fragmento del resultado para esta base de datos (incluye el error si la consulta falló)
+    """
+    db_name = _db_names()[db_key]
+    try:
+        # Las columnas salen de la caché de metadatos (_SCHEMA_CACHE) si no expiraron;
+        # la búsqueda se limita al esquema configurado de la base de datos
+        columns = _fetch_columns(db_key, [table_name], _db_schemas()[db_key])[
+            table_name
+        ]
+
+        if not columns:
+            return f"❌ No encontrada en {db_name}\n\n"
+
+        lines = "".join(f"  • {_format_column(col)}\n" for col in columns)
+        return f"✅ Encontrada en {db_name}:\n{lines}\n"
+
+    except Exception as e:
+        return f"⚠️ Error al consultar {db_name}: {str(e)}\n\n"
+
+
 @mcp.tool()
-def search_table_in_all_databases(table_name: str) -> str:
+async def search_table_in_all_databases(
+    table_name: str, ctx: Context | None = None
+) -> str:
     """
     Busca una tabla en todas las bases de datos configuradas
 
     Args:
         table_name: Nombre de la tabla a buscar
+        ctx: Contexto MCP (lo inyecta FastMCP); se usa para enviar cada base de datos como
+            notificación de avance en cuanto responde
 
     Returns:
         Información sobre la tabla encontrada en cada base de datos
     """
     try:
-        result = f"🔍 Buscando tabla '{table_name}' en todas las bases de datos:\n\n"
-
-        for db_key, db_config in DB_CONFIGS.items():
-            try:
-                conn = get_db_connection(db_key)
-                cursor = conn.cursor()
-
-                query = """
-                SELECT 
-                    COLUMN_NAME,
-                    DATA_TYPE,
-                    CHARACTER_MAXIMUM_LENGTH,
-                    IS_NULLABLE
-                FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE TABLE_NAME = ?
-                ORDER BY ORDINAL_POSITION
-                """
+        parts = [f"🔍 Buscando tabla '{table_name}' en todas las bases de datos:\n\n"]
 
-                cursor.execute(query, table_name)
-                columns = cursor.fetchall()
+        # Las bases de datos que comparten servidor (y credenciales) se resuelven con una sola
+        # consulta UNION ALL por servidor; si falla, cada una se consulta por separado
+        await asyncio.to_thread(
+            _prefetch_columns_on_shared_servers, _db_keys(), [table_name], True
+        )
 
-                if columns:
-                    result += f"✅ Encontrada en {db_config['database']}:\n"
-                    for col in columns:
-                        col_name, data_type, max_length, nullable = col
-                        length_info = f"({max_length})" if max_length else ""
-                        null_info = "NULL" if nullable == "YES" else "NOT NULL"
-                        result += (
-                            f"  • {col_name}: {data_type}{length_info} - {null_info}\n"
-                        )
-                    result += "\n"
-                else:
-                    result += f"❌ No encontrada en {db_config['database']}\n\n"
+        # El resto se consulta en paralelo en hilos
+        tasks = [
+            asyncio.ensure_future(
+                asyncio.to_thread(_search_table_in_db, db_key, table_name)
+            )
+            for db_key in _db_keys()
+        ]
 
-                conn.close()
+        # El cliente recibe cada base de datos a medida que responde, sin esperar a la más lenta
+        if ctx is not None:
+            for done, next_fragment in enumerate(asyncio.as_completed(tasks), 1):
+                fragment = await next_fragment
+                await ctx.info(fragment.strip())
+                await ctx.report_progress(done, len(tasks))
 
-            except Exception as e:
-                result += f"⚠️ Error al consultar {db_config['database']}: {str(e)}\n\n"
+        # La respuesta final conserva el orden de la configuración
+        fragments = await asyncio.gather(*tasks)
+        parts.extend(fragments)
 
-        return result
+        return "".join(parts)
 
     except Exception as e:
         return f"❌ Error general: {str(e)}"